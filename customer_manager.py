@@ -1,47 +1,233 @@
 # 引入所有需要的模組
 import tkinter as tk  # GUI 程式庫 Tkinter 的主要模組
-from tkinter import ttk, messagebox  # ttk 提供更現代的元件，messagebox 用於彈出提示視窗
+from tkinter import ttk, messagebox, filedialog  # ttk 提供更現代的元件，messagebox 用於彈出提示視窗，filedialog 用於選擇檔案
 import sqlite3  # Python 內建的 SQLite 資料庫模組
-import os  # (在此專案中未使用，但保留著以備不時之需)
+import os  # 用於處理檔案路徑 (效能測試時建立暫存資料庫)
+import sys  # 用於設定命令列模式的結束代碼
+import json  # 用於儲存與比對效能測試結果
+import time  # 用於量測效能測試的執行時間
+import tempfile  # 用於建立效能測試的暫存目錄
+import argparse  # 用於解析命令列參數
+import csv  # 用於讀取匯入的 CSV 檔案
+import queue  # 執行緒之間傳遞請求與結果的佇列
+import threading  # 背景資料庫執行緒
+import bisect  # 在已排序的列表快取中以二分搜尋找出插入位置
+from array import array  # 以精簡的整數陣列保存依相關性排序的搜尋結果 rowid
+import getpass  # 取得目前的使用者名稱，記錄在客戶變更記錄中
+import contextlib  # 沒有啟用效能分析時使用的空 context manager
+import functools  # total_ordering 用於補齊遞減排序包裝類別的比較運算
+from collections import OrderedDict, deque  # 最近開啟客戶的 LRU 快取；效能分析事件的環狀緩衝區
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple  # 型別提示
 
-# --- 主應用程式類別 ---
-class CustomerApp:
+# --- 資料模型 ---
+NOTES_PREVIEW_LENGTH = 80  # 列表只取出備註的前幾個字元作為預覽，完整內容在開啟詳細資料時才讀取
+
+class Customer(NamedTuple):
+    """一筆客戶資料。category 是分類名稱，若客戶沒有分類 (或分類已被刪除) 則為 None。"""
+    id: str
+    name: str
+    category_id: Optional[int]
+    category: Optional[str]
+    notes: str
+
+    def tree_values(self):
+        """返回顯示在 Treeview 中的欄位值 (客戶 ID, 名稱, 分類, 備註預覽)"""
+        return (self.id, self.name, self.category or "", (self.notes or "")[:NOTES_PREVIEW_LENGTH])
+
+    def preview(self):
+        """返回備註截短為預覽的副本，與列表查詢取得的資料相同"""
+        if self.notes and len(self.notes) > NOTES_PREVIEW_LENGTH:
+            return self._replace(notes=self.notes[:NOTES_PREVIEW_LENGTH])
+        return self
+
+@functools.total_ordering
+class _Descending:
+    """包裝一個值，使它在 Python 的比較中以相反的順序排列 (用於遞減排序的欄位)"""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+class SortOrder:
     """
-    客戶管理應用程式的主類別。
-    這個類別封裝了所有與應用程式相關的資料和功能，
-    包括 UI 介面、資料庫操作和事件處理。
+    客戶列表的排序方式：由 (欄位, 是否遞減) 組成的多欄排序。
+    若排序欄位中沒有客戶 ID，最後會自動加上客戶 ID 作為決勝鍵，確保每一列都有唯一的位置，
+    keyset pagination 才能準確地從上一頁的最後一列接續下去。
     """
-    def __init__(self, root):
+    # 可排序的欄位與對應的 SQL 運算式。分類與備註可能是 NULL，以空字串代替，
+    # 讓 SQL 的比較結果與 Python 端 (values/sort_key) 一致。
+    # 列表中只有備註的預覽，因此備註欄位是依預覽排序的 (預覽相同時再依客戶 ID)。
+    COLUMNS = {
+        "id": "c.id",
+        "name": "c.name",
+        "category": "IFNULL(cat.name, '')",
+        "notes": f"substr(IFNULL(c.notes, ''), 1, {NOTES_PREVIEW_LENGTH})",
+    }
+
+    def __init__(self, keys=(("name", False),)):
         """
-        類別的初始化函式 (建構子)。
-        當一個 CustomerApp 物件被建立時，這個函式會被自動呼叫。
-        :param root: Tkinter 的主視窗 (Tk) 物件。
+        :param keys: (欄位, 是否遞減) 的序列，欄位為 COLUMNS 中的名稱。
         """
-        # --- 基礎設定 ---
-        self.root = root  # 將主視窗物件儲存為實例變數
-        self.root.title("簡易客戶分級系統")  # 設定視窗標題
-        self.root.geometry("850x600")  # 設定視窗的初始大小
+        keys = tuple(keys)
+        if not any(column == "id" for column, _ in keys):
+            keys += (("id", keys[-1][1] if keys else False),)
+        self.keys = keys
 
-        # --- 實例變數 ---
-        self.db_name = "database.db"  # 資料庫檔案名稱
-        self.details_window = None  # 用來追蹤詳細資料視窗是否存在，避免重複開啟
-        
-        # --- 程式啟動流程 ---
-        self.conn = self.init_database()  # 初始化資料庫，並取得連線物件
-        self.create_widgets()  # 建立所有 UI 元件
-        self.load_categories()  # 從資料庫載入分類資料
-        self.load_customers()  # 從資料庫載入客戶資料
+    def __eq__(self, other):
+        return isinstance(other, SortOrder) and self.keys == other.keys
+
+    def values(self, customer):
+        """返回一位客戶在各排序欄位的值，用作 keyset pagination 的分頁鍵"""
+        fields = {"id": customer.id, "name": customer.name,
+                  "category": customer.category or "", "notes": (customer.notes or "")[:NOTES_PREVIEW_LENGTH]}
+        return tuple(fields[column] for column, _ in self.keys)
+
+    def sort_key(self, customer):
+        """返回可直接在 Python 中比較的排序鍵，順序與 SQL 的 ORDER BY 相同"""
+        return tuple(_Descending(value) if descending else value
+                     for value, (_, descending) in zip(self.values(customer), self.keys))
 
-    def init_database(self):
+    def order_by(self, reverse=False):
+        """返回 ORDER BY 子句的內容；reverse 為 True 時所有欄位反向排序 (用於往前翻頁)"""
+        return ", ".join(f"{self.COLUMNS[column]} {'DESC' if descending != reverse else 'ASC'}"
+                         for column, descending in self.keys)
+
+    def keyset_condition(self, values, reverse=False):
         """
-        初始化資料庫。如果資料庫檔案或資料表不存在，則會自動建立。
-        :return: 返回一個資料庫連線物件。
+        返回「排在 values 之後」的 WHERE 條件與參數；reverse 為 True 時則是「排在 values 之前」。
+        所有欄位方向相同時使用 row value 比較，SQLite 可以直接以索引範圍搜尋；
+        方向不同時則展開為 (a > ?) OR (a = ? AND b < ?) ... 的形式。
+        第一個排序鍵是運算式 (例如備註的預覽) 時，另外加上它單獨的範圍條件：
+        SQLite 在運算式索引上只能以單一運算式的比較做範圍搜尋，無法使用 row value 比較。
         """
-        conn = sqlite3.connect(self.db_name)  # 連線到 SQLite 資料庫檔案
-        cursor = conn.cursor()  # 建立一個 cursor 物件，用來執行 SQL 指令
+        expressions = [self.COLUMNS[column] for column, _ in self.keys]
+        greater = [descending == reverse for _, descending in self.keys]  # 每個欄位是否要「大於」
+        bound, bound_params = "", []
+        if "(" in expressions[0]:
+            bound, bound_params = f"{expressions[0]} {'>=' if greater[0] else '<='} ? AND ", [values[0]]
+        if all(greater) or not any(greater):
+            op = ">" if greater[0] else "<"
+            return (f"{bound}({', '.join(expressions)}) {op} ({', '.join('?' * len(values))})",
+                    bound_params + list(values))
+        parts, params = [], []
+        for i, expression in enumerate(expressions):
+            terms = [f"{prefix} = ?" for prefix in expressions[:i]] + [f"{expression} {'>' if greater[i] else '<'} ?"]
+            parts.append("(" + " AND ".join(terms) + ")")
+            params.extend(values[:i + 1])
+        return f"{bound}(" + " OR ".join(parts) + ")", bound_params + params
+
+class ImportResult(NamedTuple):
+    """批次匯入客戶的結果"""
+    inserted: int  # 成功新增的筆數
+    duplicates: List[str]  # 因客戶 ID 已存在 (或在檔案中重複出現) 而略過的客戶 ID
+    errors: List[str]  # 因資料不完整或分類不存在而略過的資料列說明
+    created_categories: List[str]  # 匯入過程中自動建立的分類名稱
+
+class HistoryEntry(NamedTuple):
+    """
+    客戶變更記錄中的一筆。before 與 after 是這次變更前後的客戶資料
+    ({"name", "category_id", "notes"} 的字典)，客戶不存在時為 None。
+    """
+    id: int
+    timestamp: float  # 變更時間 (Unix 時間，秒)
+    user: str  # 執行變更的使用者
+    op: str  # 'I' 新增、'U' 修改、'D' 刪除
+    before: Optional[dict]
+    after: Optional[dict]
+
+# --- 資料存取層 ---
+class CustomerRepository:
+    """
+    負責所有資料庫操作的類別。
+    它擁有自己的 SQLite 連線，並且完全不依賴 Tkinter，
+    因此可以在沒有視窗環境的情況下 (例如命令列或效能測試) 單獨使用。
+    發生錯誤時會直接拋出 sqlite3 的例外，由呼叫端決定如何呈現給使用者。
+    """
+    # 列表查詢的共用部分：客戶資料加上分類名稱
+    SELECT_CUSTOMERS = ("SELECT c.id, c.name, c.category_id, cat.name, c.notes "
+                        "FROM customers c LEFT JOIN categories cat ON c.category_id = cat.id")
+    # 列表與搜尋使用的欄位：備註只取前 NOTES_PREVIEW_LENGTH 個字元，
+    # 備註很長時可以大幅減少每一頁讀取與保留在記憶體中的資料量
+    PREVIEW_COLUMNS = (f"c.id, c.name, c.category_id, cat.name, "
+                       f"substr(c.notes, 1, {NOTES_PREVIEW_LENGTH})")
+    SELECT_PREVIEWS = ("SELECT " + PREVIEW_COLUMNS + " "
+                       "FROM customers c LEFT JOIN categories cat ON c.category_id = cat.id")
 
+    # 每個連線開啟時套用的 PRAGMA 設定
+    # WAL 讓讀取不會被寫入阻擋；synchronous=NORMAL 在 WAL 模式下仍能保證資料庫不會損毀，
+    # 只是在斷電時可能遺失最後幾筆已提交的交易，換來每次 commit 不必等待 fsync。
+    CONNECTION_PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -16000",  # 負數代表 KiB，約 16 MB 的頁面快取
+        "PRAGMA mmap_size = 268435456",  # 以記憶體映射讀取最多 256 MB 的資料庫檔案
+        "PRAGMA temp_store = MEMORY",
+    )
+
+    def __init__(self, db_name: str, migrate: bool = True):
+        """
+        :param db_name: SQLite 資料庫檔案名稱。
+        :param migrate: 是否在開啟時將資料庫結構升級到最新版本。
+                        為 False 時只建立讀取客戶列表所需的基本資料表 (版本 1)，其餘遷移由呼叫端稍後以 init_schema 執行，
+                        讓 GUI 可以先顯示第一頁，再於背景完成可能很耗時的遷移 (例如建立索引)。
+        """
+        self.db_name = db_name
+        self.user = self._current_user()  # 記錄在變更記錄中的使用者名稱
+        # 最近一次全文檢索的 ((搜尋文字, 分類 ID), 已排序的 rowid 陣列, 已掃描到的最後一個 rowid, 是否已取得全部結果)
+        self._ranked_search = None
+        self.conn = sqlite3.connect(db_name)  # 連線到 SQLite 資料庫檔案
+        for pragma in self.CONNECTION_PRAGMAS:
+            self.conn.execute(pragma)
+        self.init_schema(target_version=None if migrate else 1)
+
+    def init_schema(self, target_version: Optional[int] = None, progress=None) -> int:
+        """
+        初始化資料庫，並將資料庫結構升級到最新版本。
+        目前的版本記錄在 PRAGMA user_version 中，只有尚未套用過的遷移會被執行，
+        因此舊的 database.db 會在開啟時直接原地升級。
+        每個遷移都在自己的交易中執行，失敗時會完整回復，版本號也不會前進。
+        :param target_version: 只升級到此版本 (預設為最新版本)。
+        :param progress: 每完成一個遷移時被呼叫的函式，參數為 (已完成的遷移數, 需要執行的遷移總數)。
+        :return: 執行的遷移數。
+        """
+        version = self.schema_version()
+        pending = list(enumerate(self.MIGRATIONS, start=1))[version:target_version]  # (遷移後的版本, 遷移函式)
+        for done, (new_version, migration) in enumerate(pending, start=1):
+            cursor = self.conn.cursor()  # 建立一個 cursor 物件，用來執行 SQL 指令
+            cursor.execute("BEGIN")  # DDL 預設不會自動開啟交易，因此在這裡明確開始
+            try:
+                migration(self, cursor)
+                cursor.execute(f"PRAGMA user_version = {new_version}")
+                self.conn.commit()  # 提交變更，將上述操作寫入資料庫檔案
+            except Exception:
+                self.conn.rollback()
+                raise
+            if progress: progress(done, len(pending))
+        return len(pending)
+
+    def schema_version(self) -> int:
+        """返回資料庫目前的結構版本 (PRAGMA user_version)"""
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    @staticmethod
+    def _current_user() -> str:
+        """返回目前作業系統的使用者名稱，無法取得時返回空字串"""
+        try:
+            return getpass.getuser()
+        except Exception:  # 沒有設定使用者環境變數，且系統中也查不到目前的 UID 時
+            return ""
+
+    # --- 資料庫結構遷移 ---
+    def _migrate_base_schema(self, cursor):
+        """版本 1：建立分類與客戶資料表，並新增預設分類"""
         # 建立「分類」資料表 (categories)
-        # IF NOT EXISTS 可以確保如果資料表已存在，不會重複建立而報錯
+        # IF NOT EXISTS 可以確保在加入版本管理之前就建立好的資料表不會重複建立而報錯
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS categories (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -66,14 +252,1320 @@ class CustomerApp:
             for cat in default_categories:
                 # 使用 ? 作為佔位符，可以防止 SQL 注入攻擊
                 cursor.execute("INSERT INTO categories (name) VALUES (?)", (cat,))
-        
-        conn.commit()  # 提交變更，將上述操作寫入資料庫檔案
-        return conn  # 返回連線物件
+
+    def _migrate_list_indexes(self, cursor):
+        """
+        版本 2：為客戶列表的查詢建立索引。
+        (name, id) 對應全部顯示時的 ORDER BY c.name, c.id 與 keyset 條件；
+        (category_id, name, id) 讓依分類篩選時可以直接依序讀出該分類的客戶，不需要全表掃描與暫存排序。
+        """
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_name ON customers (name, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_category_name ON customers (category_id, name, id)")
+
+    def _migrate_full_text_search(self, cursor):
+        """
+        版本 3：建立客戶名稱與備註的全文檢索索引 (FTS5)。
+        使用 trigram 分詞器，以每三個字元為一組建立索引，因此不需要斷詞也能搜尋中文等 CJK 文字的任意片段。
+        customers_fts 是 external content 表，本身不重複儲存文字，只以 rowid 對應 customers，
+        並由觸發器在 customers 新增、修改、刪除時同步更新。
+        (customers 的 rowid 不是 INTEGER PRIMARY KEY，執行 VACUUM 後可能改變，
+        屆時需以 INSERT INTO customers_fts(customers_fts) VALUES ('rebuild') 重建索引。)
+        """
+        cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5(
+            name, notes, content='customers', content_rowid='rowid', tokenize='trigram'
+        )""")
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS customers_fts_insert AFTER INSERT ON customers BEGIN
+            INSERT INTO customers_fts (rowid, name, notes) VALUES (new.rowid, new.name, new.notes);
+        END""")
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS customers_fts_delete AFTER DELETE ON customers BEGIN
+            INSERT INTO customers_fts (customers_fts, rowid, name, notes) VALUES ('delete', old.rowid, old.name, old.notes);
+        END""")
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS customers_fts_update AFTER UPDATE OF name, notes ON customers BEGIN
+            INSERT INTO customers_fts (customers_fts, rowid, name, notes) VALUES ('delete', old.rowid, old.name, old.notes);
+            INSERT INTO customers_fts (rowid, name, notes) VALUES (new.rowid, new.name, new.notes);
+        END""")
+        # 為既有的客戶資料建立索引
+        cursor.execute("INSERT INTO customers_fts (customers_fts) VALUES ('rebuild')")
+
+    def _migrate_sort_indexes(self, cursor):
+        """
+        版本 4：支援列表依欄位標題排序。
+        (category_id, id) 讓依客戶 ID 排序時也能在分類篩選中直接依序讀取。
+        刪除分類後殘留的 category_id 改為 NULL，沒有分類的客戶才能以 category_id IS NULL 透過索引找到。
+        """
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_category_id ON customers (category_id, id)")
+        cursor.execute("""
+        UPDATE customers SET category_id = NULL
+        WHERE category_id IS NOT NULL AND category_id NOT IN (SELECT id FROM categories)""")
+
+    def _migrate_category_counts(self, cursor):
+        """
+        版本 5：建立各分類客戶數的彙總表 category_counts，由觸發器在客戶新增、刪除或改變分類時即時更新，
+        讀取各分類的客戶數時就不必每次對整個客戶表執行 COUNT(*) GROUP BY。
+        沒有分類的客戶記在 category_id = 0 (分類 ID 由 1 開始，不會衝突)。
+        """
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS category_counts (
+            category_id INTEGER PRIMARY KEY,
+            customer_count INTEGER NOT NULL DEFAULT 0
+        )""")
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS category_counts_insert AFTER INSERT ON customers BEGIN
+            INSERT INTO category_counts (category_id, customer_count) VALUES (IFNULL(new.category_id, 0), 1)
+            ON CONFLICT (category_id) DO UPDATE SET customer_count = customer_count + 1;
+        END""")
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS category_counts_delete AFTER DELETE ON customers BEGIN
+            UPDATE category_counts SET customer_count = customer_count - 1 WHERE category_id = IFNULL(old.category_id, 0);
+        END""")
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS category_counts_update AFTER UPDATE OF category_id ON customers
+        WHEN old.category_id IS NOT new.category_id BEGIN
+            UPDATE category_counts SET customer_count = customer_count - 1 WHERE category_id = IFNULL(old.category_id, 0);
+            INSERT INTO category_counts (category_id, customer_count) VALUES (IFNULL(new.category_id, 0), 1)
+            ON CONFLICT (category_id) DO UPDATE SET customer_count = customer_count + 1;
+        END""")
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS category_counts_category_delete AFTER DELETE ON categories BEGIN
+            DELETE FROM category_counts WHERE category_id = old.id;
+        END""")
+        # 以既有的客戶資料計算初始值
+        cursor.execute("DELETE FROM category_counts")
+        cursor.execute("""
+        INSERT INTO category_counts (category_id, customer_count)
+        SELECT IFNULL(category_id, 0), COUNT(*) FROM customers GROUP BY IFNULL(category_id, 0)""")
+
+    def _migrate_change_log(self, cursor):
+        """
+        版本 6：建立只會附加資料的客戶變更記錄 customer_history。
+        每筆記錄只保存被改變欄位「變更前」的值 (JSON)：修改時只有改變的欄位，刪除時是整筆資料，新增時為 NULL。
+        從客戶目前的資料依時間倒推，就能還原出任何一個時間點的版本。
+        記錄由 CustomerRepository 的寫入函式在同一個交易中寫入 (觸發器無法得知執行變更的使用者)。
+        """
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS customer_history (
+            id INTEGER PRIMARY KEY,
+            customer_id TEXT NOT NULL,
+            ts REAL NOT NULL,
+            user TEXT NOT NULL,
+            op TEXT NOT NULL CHECK (op IN ('I', 'U', 'D')),
+            changes TEXT
+        )""")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_customer_history_customer ON customer_history (customer_id, ts)")
+
+    def _migrate_notes_sort_indexes(self, cursor):
+        """
+        版本 7：列表依備註排序時使用的運算式索引。備註欄位是依預覽 (SortOrder.COLUMNS["notes"]) 排序的，
+        索引的運算式必須與它完全相同，查詢才能直接依索引的順序讀取一頁，而不必每次掃描並排序整個客戶表。
+        """
+        preview = f"substr(IFNULL(notes, ''), 1, {NOTES_PREVIEW_LENGTH})"
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_customers_notes ON customers ({preview}, id)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_customers_category_notes ON customers (category_id, {preview}, id)")
+
+    # 依序排列的遷移函式：第 N 個函式會把資料庫從版本 N-1 升級到版本 N
+    MIGRATIONS = (
+        _migrate_base_schema,
+        _migrate_list_indexes,
+        _migrate_full_text_search,
+        _migrate_sort_indexes,
+        _migrate_category_counts,
+        _migrate_change_log,
+        _migrate_notes_sort_indexes,
+    )
+
+    def check_integrity(self) -> List[str]:
+        """
+        以 PRAGMA quick_check 檢查資料庫檔案是否損毀。所需時間與資料庫大小成正比，GUI 會在背景的另一個連線上執行。
+        :return: 發現的問題說明，資料庫正常時為空列表。
+        """
+        problems = [row[0] for row in self.conn.execute("PRAGMA quick_check")]
+        return [] if problems == ["ok"] else problems
+
+    def close(self) -> None:
+        """關閉資料庫連線。關閉前先讓 SQLite 依照使用情況更新查詢規劃所需的統計資訊。"""
+        self.conn.execute("PRAGMA optimize")
+        self.conn.close()
+
+    def explain_hot_queries(self) -> dict:
+        """
+        以 EXPLAIN QUERY PLAN 檢查列表常用查詢的執行計畫。
+        :return: {查詢名稱: (是否有使用索引且不需暫存排序, 執行計畫各步驟的說明)} 的字典。
+        """
+        hot_queries = {
+            "第一頁 (全部顯示)": self._page_query(None, None, None, 50),
+            "下一頁 (全部顯示)": self._page_query(None, ("", ""), None, 50),
+            "上一頁 (全部顯示)": self._page_query(None, None, ("", ""), 50),
+            "第一頁 (依分類篩選)": self._page_query(1, None, None, 50),
+            "下一頁 (依分類篩選)": self._page_query(1, ("", ""), None, 50),
+            "上一頁 (依分類篩選)": self._page_query(1, None, ("", ""), 50),
+            "下一頁 (依客戶 ID 排序)": self._page_query(None, ("",), None, 50, SortOrder([("id", False)])),
+            "上一頁 (依客戶 ID 遞減排序，依分類篩選)": self._page_query(1, None, ("",), 50, SortOrder([("id", True)])),
+            "下一頁 (依名稱遞減排序)": self._page_query(None, ("", ""), None, 50, SortOrder([("name", True)])),
+            "依分類再依名稱排序 (依分類篩選)": self._single_page_query(1, ("", "", ""), None, 50,
+                                                             SortOrder([("category", False), ("name", False)])),
+            "依分類再依名稱排序 (走訪其中一個分類)": self._page_query(1, ("", ""), None, 50, SortOrder([("name", False)])),
+            "依分類再依名稱排序 (沒有分類)": self._page_query(None, ("", ""), None, 50, SortOrder([("name", False)]),
+                                                         uncategorized=True),
+            "下一頁 (依備註排序)": self._page_query(None, ("", ""), None, 50, SortOrder([("notes", False)])),
+            "上一頁 (依備註遞減排序，依分類篩選)": self._page_query(1, None, ("", ""), 50, SortOrder([("notes", True)])),
+            "客戶變更記錄": (self.HISTORY_QUERY, [""]),
+        }
+        plans = {}
+        for label, (query, params) in hot_queries.items():
+            details = [row[3] for row in self.conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+            uses_index = all("USING" in detail for detail in details if detail.startswith(("SCAN", "SEARCH")))
+            plans[label] = (uses_index and not any("TEMP B-TREE" in detail for detail in details), details)
+        return plans
+
+    # --- 分類 ---
+    def list_categories(self) -> List[Tuple[int, str]]:
+        """返回所有分類的 (ID, 名稱)，依名稱排序"""
+        return self.conn.execute("SELECT id, name FROM categories ORDER BY name").fetchall()
+
+    def category_counts(self) -> Tuple[List[Tuple[int, str, int]], int]:
+        """
+        返回各分類的客戶數。數字來自由觸發器維護的 category_counts 彙總表，成本只與分類數量有關。
+        :return: ([(分類 ID, 名稱, 客戶數)，依名稱排序], 沒有分類的客戶數)。
+        """
+        rows = self.conn.execute("""
+            SELECT cat.id, cat.name, IFNULL(cc.customer_count, 0) FROM categories cat
+            LEFT JOIN category_counts cc ON cc.category_id = cat.id ORDER BY cat.name""").fetchall()
+        uncategorized = self.conn.execute("SELECT customer_count FROM category_counts WHERE category_id = 0").fetchone()
+        return rows, uncategorized[0] if uncategorized else 0
+
+    def add_category(self, name: str) -> int:
+        """新增一個分類並返回它的 ID。名稱重複時會拋出 sqlite3.IntegrityError。"""
+        with self.conn:  # with 區塊結束時自動 commit，發生例外時自動 rollback
+            cursor = self.conn.execute("INSERT INTO categories (name) VALUES (?)", (name,))
+        return cursor.lastrowid
+
+    def delete_category(self, category_id: int) -> None:
+        """刪除一個分類。使用此分類的客戶會失去分類連結 (category_id 設為 NULL)。"""
+        with self.conn:
+            self._log_changes("U", "json_object('category_id', category_id)", "category_id = ?", [category_id])
+            self.conn.execute("UPDATE customers SET category_id = NULL WHERE category_id = ?", (category_id,))
+            self.conn.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+
+    # --- 變更記錄 ---
+    HISTORY_FIELDS = ("name", "category_id", "notes")  # 變更記錄追蹤的客戶欄位
+    # 依 (customer_id, ts) 索引取出一位客戶的所有記錄；記錄的先後以遞增的 id 為準 (在 Python 中排序)，
+    # ts 只用於顯示，系統時鐘被往回調整時也不會把變更套用錯順序
+    HISTORY_QUERY = "SELECT id, ts, user, op, changes FROM customer_history WHERE customer_id = ?"
+    INSERT_HISTORY = "INSERT INTO customer_history (customer_id, ts, user, op, changes) VALUES (?, ?, ?, ?, ?)"
+    OLD_ROW_JSON = "json_object('name', name, 'category_id', category_id, 'notes', notes)"  # 刪除時保存的整筆資料
+
+    @staticmethod
+    def _encode_changes(changes):
+        """將變更前的欄位值編碼成精簡的 JSON (與 SQLite 的 json_object 格式相同)"""
+        return json.dumps(changes, ensure_ascii=False, separators=(",", ":"))
+
+    def _log_changes(self, op, changes_sql, condition, params):
+        """
+        在目前的交易中，為符合 condition 的每位客戶寫入一筆變更記錄。必須在實際修改或刪除之前呼叫，
+        changes_sql 才能讀到變更前的值。記錄直接以 INSERT ... SELECT 寫入，不經過 Python。
+        """
+        self.conn.execute(
+            f"INSERT INTO customer_history (customer_id, ts, user, op, changes) "
+            f"SELECT id, ?, ?, ?, {changes_sql} FROM customers WHERE {condition}",
+            [time.time(), self.user, op] + list(params))
+
+    def _log_inserts(self, cust_ids):
+        """在目前的交易中為新增的客戶寫入變更記錄"""
+        now = time.time()
+        self.conn.executemany(self.INSERT_HISTORY, ((cust_id, now, self.user, "I", None) for cust_id in cust_ids))
+
+    def _log_updates(self, rows):
+        """
+        在目前的交易中為即將被更新的客戶寫入變更記錄，只保存實際改變的欄位。
+        :param rows: {客戶 ID: (名稱, 分類 ID, 備註)} 的字典，是更新後的值。
+        """
+        now, entries = time.time(), []
+        if len(rows) == 1:  # 單筆修改 (最常見的情況) 直接以主鍵查詢
+            old_rows = self.conn.execute("SELECT id, name, category_id, notes FROM customers WHERE id = ?", tuple(rows))
+        else:
+            old_rows = self.conn.execute(
+                "SELECT id, name, category_id, notes FROM customers WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(rows)),))
+        for cust_id, *old in old_rows:
+            changes = {field: old_value for field, old_value, new_value in zip(self.HISTORY_FIELDS, old, rows[cust_id])
+                       if old_value != new_value}
+            if changes:
+                entries.append((cust_id, now, self.user, "U", self._encode_changes(changes)))
+        self.conn.executemany(self.INSERT_HISTORY, entries)
+
+    def customer_history(self, cust_id: str) -> List[HistoryEntry]:
+        """
+        返回一位客戶的變更記錄 (由新到舊，依寫入順序)。
+        每筆記錄的變更前後版本是從客戶目前的資料開始，依序套用較新記錄中保存的舊值倒推出來的。
+        """
+        with self.conn:
+            self.conn.execute("BEGIN")  # 在同一個讀取交易中取得客戶目前的資料與變更記錄，兩者才會一致
+            row = self.conn.execute("SELECT name, category_id, notes FROM customers WHERE id = ?", (cust_id,)).fetchone()
+            history = sorted(self.conn.execute(self.HISTORY_QUERY, (cust_id,)), reverse=True)
+        state = dict(zip(self.HISTORY_FIELDS, row)) if row else None
+        entries = []
+        for entry_id, ts, user, op, changes in history:
+            after = state
+            if op == "I":
+                state = None
+            elif op == "D":
+                state = json.loads(changes)
+            else:
+                state = dict(state or {}, **json.loads(changes))
+            entries.append(HistoryEntry(entry_id, ts, user, op, state, after))
+        return entries
+
+    def restore_customer(self, cust_id: str, version: dict) -> Customer:
+        """
+        將客戶還原為變更記錄中的某個版本 (客戶已被刪除時重新新增)，還原本身也會被記錄下來。
+        版本中的分類若已被刪除，還原後的客戶沒有分類。
+        :return: 還原後的客戶資料。
+        """
+        name, notes = version["name"], version.get("notes")
+        with self.conn:
+            # 明確開始寫入交易，檢查客戶與分類是否存在和實際寫入之間，其他連線無法修改資料
+            self.conn.execute("BEGIN IMMEDIATE")
+            category_id = version.get("category_id")
+            if category_id is not None and not self.conn.execute(
+                    "SELECT 1 FROM categories WHERE id = ?", (category_id,)).fetchone():
+                category_id = None
+            if self.conn.execute("SELECT 1 FROM customers WHERE id = ?", (cust_id,)).fetchone():
+                self._update_customer(cust_id, name, category_id, notes)
+            else:
+                self._insert_customer(cust_id, name, category_id, notes)
+        return self.get_customer(cust_id)
+
+    # --- 客戶 ---
+    def add_customer(self, cust_id: str, name: str, category_id: Optional[int], notes: str) -> None:
+        """新增一位客戶。客戶 ID 重複時會拋出 sqlite3.IntegrityError。"""
+        with self.conn:
+            self._insert_customer(cust_id, name, category_id, notes)
+
+    def update_customer(self, cust_id: str, name: str, category_id: Optional[int], notes: str) -> None:
+        """更新一位客戶的名稱、分類與備註"""
+        with self.conn:
+            self._update_customer(cust_id, name, category_id, notes)
+
+    def _insert_customer(self, cust_id, name, category_id, notes):
+        """在目前的交易中新增一位客戶並寫入變更記錄 (不提交)"""
+        self.conn.execute("INSERT INTO customers (id, name, category_id, notes) VALUES (?, ?, ?, ?)",
+                          (cust_id, name, category_id, notes))
+        self._log_inserts((cust_id,))
+
+    def _update_customer(self, cust_id, name, category_id, notes):
+        """在目前的交易中更新一位客戶並寫入變更記錄 (不提交)"""
+        self._log_updates({cust_id: (name, category_id, notes)})
+        self.conn.execute("UPDATE customers SET name = ?, category_id = ?, notes = ? WHERE id = ?",
+                          (name, category_id, notes, cust_id))
+
+    def delete_customer(self, cust_id: str) -> None:
+        """刪除一位客戶"""
+        with self.conn:
+            self._log_changes("D", self.OLD_ROW_JSON, "id = ?", [cust_id])
+            self.conn.execute("DELETE FROM customers WHERE id = ?", (cust_id,))
+
+    def get_customer(self, cust_id: str) -> Optional[Customer]:
+        """依客戶 ID 取得一筆完整的客戶資料 (包含完整備註)，找不到時返回 None"""
+        row = self.conn.execute(self.SELECT_CUSTOMERS + " WHERE c.id = ?", (cust_id,)).fetchone()
+        return Customer(*row) if row else None
+
+    def add_customers(self, rows: Iterable[Tuple[str, str, Optional[int], str]]) -> int:
+        """
+        在單一交易中批次新增多位客戶。
+        :param rows: (客戶 ID, 名稱, 分類 ID, 備註) 的序列。
+        :return: 新增的筆數。任何一筆 ID 重複時整批都不會寫入，並拋出 sqlite3.IntegrityError。
+        """
+        rows = list(rows)
+        with self.conn:
+            cursor = self.conn.executemany(
+                "INSERT INTO customers (id, name, category_id, notes) VALUES (?, ?, ?, ?)", rows)
+            self._log_inserts(row[0] for row in rows)
+        return cursor.rowcount
+
+    def update_customers(self, rows: Iterable[Tuple[str, Optional[int], str, str]]) -> int:
+        """
+        在單一交易中批次更新多位客戶。
+        :param rows: (名稱, 分類 ID, 備註, 客戶 ID) 的序列。
+        :return: 實際被更新的筆數。
+        """
+        rows = list(rows)
+        with self.conn:
+            self._log_updates({cust_id: (name, category_id, notes) for name, category_id, notes, cust_id in rows})
+            cursor = self.conn.executemany(
+                "UPDATE customers SET name = ?, category_id = ?, notes = ? WHERE id = ?", rows)
+        return cursor.rowcount
+
+    def import_customers(self, records: Iterable[Tuple[int, str, str, str, str]], create_categories: bool = False,
+                         batch_size: int = 5000, progress=None) -> ImportResult:
+        """
+        批次匯入客戶。資料會以 batch_size 筆為一組，每組在一個交易中以 executemany 寫入，
+        因此可以逐批串流處理大型檔案，不必把整個檔案讀進記憶體。
+        :param records: (列號, 客戶 ID, 名稱, 分類名稱, 備註) 的序列，列號只用於錯誤說明。
+        :param create_categories: 分類名稱不存在時是否自動建立；否則該列會被略過並記錄為錯誤。
+        :param batch_size: 每個交易寫入的筆數。
+        :param progress: 每完成一組時被呼叫的函式，參數為目前已處理的資料列數。
+        """
+        categories = {name: cat_id for cat_id, name in self.list_categories()}
+        inserted, processed = 0, 0
+        duplicates, errors, created = [], [], []
+        batch = []
+
+        def flush():
+            nonlocal inserted
+            with self.conn:
+                # 同一組內重複的 ID 只保留第一筆
+                rows = {}
+                for row in batch:
+                    if row[0] in rows: duplicates.append(row[0])
+                    else: rows[row[0]] = row
+                # 一次查出這一組中已經存在於資料庫的 ID
+                existing = {cust_id for (cust_id,) in self.conn.execute(
+                    "SELECT id FROM customers WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(list(rows)),))}
+                duplicates.extend(cust_id for cust_id in rows if cust_id in existing)  # 依檔案中的順序回報
+                new_rows = [row for cust_id, row in rows.items() if cust_id not in existing]
+                self.conn.executemany("INSERT INTO customers (id, name, category_id, notes) VALUES (?, ?, ?, ?)", new_rows)
+                self._log_inserts(row[0] for row in new_rows)
+            inserted += len(new_rows)
+            batch.clear()
+            if progress: progress(processed)
+
+        for line_no, cust_id, name, category_name, notes in records:
+            processed += 1
+            if not cust_id or not name or not category_name:
+                errors.append(f"第 {line_no} 列：客戶 ID、名稱和分類為必填項")
+                continue
+            category_id = categories.get(category_name)
+            if category_id is None:
+                if not create_categories:
+                    errors.append(f"第 {line_no} 列：分類 '{category_name}' 不存在")
+                    continue
+                category_id = self.add_category(category_name)
+                categories[category_name] = category_id
+                created.append(category_name)
+            batch.append((cust_id, name, category_id, notes))
+            if len(batch) >= batch_size:
+                flush()
+        flush()  # 寫入最後不足一組的資料，並回報最終進度
+        return ImportResult(inserted, duplicates, errors, created)
+
+    def fetch_page(self, category_id: Optional[int] = None, after: Optional[tuple] = None,
+                   before: Optional[tuple] = None, limit: int = 50, order: Optional[SortOrder] = None) -> List[Customer]:
+        """
+        以 keyset pagination 取得一頁客戶資料，排序與分頁都在 SQL 中完成。
+        返回的備註只是預覽 (最多 NOTES_PREVIEW_LENGTH 個字元)，完整資料請用 get_customer 取得。
+        :param category_id: 若提供，只返回此分類的客戶。
+        :param after: 若提供分頁鍵 (即 order.values() 的結果)，則取得排在它之後的資料。
+        :param before: 若提供分頁鍵，則取得排在它之前的資料 (結果仍依正向排序返回)。
+        :param limit: 一頁最多的筆數。
+        :param order: 排序方式，預設依 (客戶名稱, 客戶 ID) 遞增排序。
+        """
+        order = order or SortOrder()
+        if order.keys[0][0] == "category" and not category_id:
+            rows = self._fetch_page_by_category(after, before, limit, order)
+        else:
+            query, params = self._single_page_query(category_id, after, before, limit, order)
+            rows = [Customer(*row) for row in self.conn.execute(query, params)]
+        if before is not None:
+            rows.reverse()
+        return rows
+
+    def _single_page_query(self, category_id, after, before, limit, order):
+        """
+        組出 fetch_page 以單一查詢取得一頁時的 SQL 與參數。
+        以分類為第一排序鍵但已依分類篩選時，分類名稱在整頁中都相同，因此去掉這個排序鍵 (與分頁鍵中對應的值)，
+        讓查詢可以直接以 (category_id, ...) 索引依序讀取，而不必把整個分類讀出來暫存排序。
+        """
+        if order.keys[0][0] == "category" and category_id:
+            order = SortOrder(order.keys[1:])
+            after = after[1:] if after is not None else None
+            before = before[1:] if before is not None else None
+        return self._page_query(category_id, after, before, limit, order)
+
+    def _fetch_page_by_category(self, after, before, limit, order):
+        """
+        以分類為第一排序鍵時的分頁查詢。
+        分類名稱在 categories 資料表中，直接 ORDER BY 會需要掃描整個客戶表再排序；
+        這裡改為依分類名稱的順序逐一查詢每個分類，每個分類內以 (category_id, ...) 索引依其餘的排序鍵讀取，
+        湊滿一頁就停止，因此成本只與頁面大小和分類數量有關。
+        往前翻頁 (before) 時返回的結果是反向的，由 fetch_page 反轉。
+        """
+        backward = before is not None
+        position = before if backward else after
+        rest = SortOrder(order.keys[1:])
+        # 沒有分類的客戶以空字串作為分類名稱，因此遞增排序時排在最前面
+        groups = [(None, "")] + self.list_categories()
+        walk_ascending = order.keys[0][1] == backward  # 依分類名稱由小到大走訪
+        if not walk_ascending:
+            groups.reverse()
+        rows = []
+        for cat_id, cat_name in groups:
+            rest_position = None
+            if position is not None:
+                if cat_name == position[0]:
+                    rest_position = position[1:]  # 分頁鍵所在的分類：從分頁鍵之後接續
+                elif (cat_name < position[0]) == walk_ascending:
+                    continue  # 整個分類都在分頁鍵之前
+            query, params = self._page_query(cat_id, None if backward else rest_position,
+                                             rest_position if backward else None,
+                                             limit - len(rows), rest, uncategorized=cat_id is None, reverse=backward)
+            rows.extend(Customer(*row) for row in self.conn.execute(query, params))
+            if len(rows) >= limit:
+                break
+        return rows
+
+    SEARCH_RANK_WINDOW = 2000  # 全文檢索每次依相關性排序的候選結果筆數
+
+    def search_page(self, text: str, category_id: Optional[int] = None, after: Optional[int] = None,
+                    before: Optional[int] = None, limit: int = 50) -> List[Customer]:
+        """
+        以全文檢索搜尋客戶名稱與備註，返回一頁依相關性排序的結果。
+        每個以空白分隔的關鍵字都必須出現 (AND)。trigram 索引只能搜尋三個字元以上的片段，
+        因此較短的關鍵字只在全文檢索找到的候選結果中以 LIKE 比對；
+        只有所有關鍵字都少於三個字元時，才改為依名稱順序逐筆比對 (LIMIT 讓它找到一頁就停止)。
+        全文檢索的結果以 SEARCH_RANK_WINDOW 筆為一個視窗，依 rowid 的順序取出候選結果後在視窗內依相關性排序，只保留 rowid；
+        分頁時從已排序的結果中取出，超出時才排序下一個視窗。因此第一頁的成本與符合的總筆數無關，
+        符合的結果不超過一個視窗時即為完整的相關性排序。
+        :param after: 若提供結果中的位置 (從 0 開始)，則取得排在它之後的結果。
+        :param before: 若提供結果中的位置，則取得排在它之前的結果。
+        """
+        if before is not None:
+            offset = max(0, before - limit)
+            limit = before - offset
+        else:
+            offset = after + 1 if after is not None else 0
+        match, short_terms = self._search_terms(text)
+        if match is None:
+            condition, params = self._like_condition(short_terms, "c.")
+            query = self.SELECT_PREVIEWS + " WHERE " + condition
+            if category_id:
+                query += " AND c.category_id = ?"
+                params.append(category_id)
+            query += " ORDER BY c.name, c.id LIMIT ? OFFSET ?"
+            params.extend((limit, offset))
+            return [Customer(*row) for row in self.conn.execute(query, params)]
+
+        key = (text, category_id)
+        if (after is None and before is None) or self._ranked_search is None or self._ranked_search[0] != key:
+            # 重新搜尋 (第一頁) 時一律重新排序，資料在上次搜尋之後的變更才會反映在結果中
+            self._ranked_search = (key, array("q"), None, False)
+        _, ranked, last_rowid, complete = self._ranked_search
+        while not complete and len(ranked) < offset + limit:
+            window = self._rank_matches(match, short_terms, category_id, last_rowid)
+            ranked.extend(window)
+            complete = len(window) < self.SEARCH_RANK_WINDOW
+            if window:
+                last_rowid = max(window)
+        self._ranked_search = (key, ranked, last_rowid, complete)
+        rowids = ranked[offset:offset + limit]
+        rows = {row[-1]: Customer(*row[:-1]) for row in self.conn.execute(
+            "SELECT " + self.PREVIEW_COLUMNS + ", c.rowid FROM customers c "
+            "LEFT JOIN categories cat ON c.category_id = cat.id WHERE c.rowid IN (SELECT value FROM json_each(?))",
+            (json.dumps(rowids.tolist()),))}
+        return [rows[rowid] for rowid in rowids if rowid in rows]  # 依相關性的順序返回 (略過已被刪除的客戶)
+
+    def _rank_matches(self, match, short_terms, category_id, after_rowid=None):
+        """
+        依 rowid 的順序取出下一個視窗 (最多 SEARCH_RANK_WINDOW 筆) 符合全文檢索條件的客戶，
+        返回它們依相關性 (再依 rowid) 排序的 rowid。FTS5 會逐筆計算相關性，
+        即使加上 ORDER BY rank LIMIT 也會為所有符合的資料列計算，因此先以 rowid 限制候選結果的數量。
+        :param after_rowid: 若提供，只取 rowid 大於它的結果 (上一個視窗的最後一筆)。
+        """
+        query = "SELECT f.rowid AS rowid, f.rank AS rank FROM customers_fts f"
+        conditions, params = ["customers_fts MATCH ?"], [match]
+        if after_rowid is not None:
+            conditions.append("f.rowid > ?")
+            params.append(after_rowid)
+        if category_id or short_terms:
+            query += " JOIN customers c ON c.rowid = f.rowid"  # 需要客戶資料表的欄位時才 JOIN
+            if category_id:
+                conditions.append("c.category_id = ?")
+                params.append(category_id)
+            if short_terms:
+                condition, like_params = self._like_condition(short_terms, "c.")
+                conditions.append(condition)
+                params.extend(like_params)
+        query += " WHERE " + " AND ".join(conditions) + " ORDER BY f.rowid LIMIT ?"
+        params.append(self.SEARCH_RANK_WINDOW)
+        return array("q", (rowid for (rowid,) in self.conn.execute(
+            f"SELECT rowid FROM ({query}) ORDER BY rank, rowid", params)))
+
+    @staticmethod
+    def _search_terms(text):
+        """
+        將搜尋文字分成全文檢索的 MATCH 查詢與較短的關鍵字。
+        三個字元以上的關鍵字以雙引號包成片語組成 MATCH 查詢 (避免使用者輸入的符號被當成 FTS5 的查詢語法)，
+        沒有這樣的關鍵字時 MATCH 查詢為 None；trigram 索引無法搜尋的短關鍵字另外返回，由 LIKE 比對。
+        :return: (MATCH 查詢或 None, 短關鍵字列表)。
+        """
+        terms = text.split()
+        long_terms = [term for term in terms if len(term) >= 3]
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in long_terms) or None
+        return match, [term for term in terms if len(term) < 3]
+
+    @staticmethod
+    def _like_condition(terms, prefix):
+        """返回以 LIKE 比對名稱與備註的 WHERE 條件與參數 (每個關鍵字都必須出現)，prefix 是欄位名稱前的資料表別名"""
+        conditions, params = ["1"], []
+        for term in terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            conditions.append(f"({prefix}name LIKE ? ESCAPE '\\' OR {prefix}notes LIKE ? ESCAPE '\\')")
+            params.extend((pattern, pattern))
+        return " AND ".join(conditions), params
+
+    # --- 批次操作 ---
+    # 批次操作的對象可以是一組客戶 ID (列表中選取的客戶)，或是符合篩選條件 (分類與搜尋文字) 的所有客戶。
+    # 每個操作都是單一的 SQL 敘述，在一個交易中完成，不會逐筆執行。
+    def _target_condition(self, ids, category_id, search):
+        """返回批次操作對象的 WHERE 條件與參數 (不使用資料表別名)"""
+        if ids is not None:
+            return "id IN (SELECT value FROM json_each(?))", [json.dumps(list(ids))]
+        conditions, params = ["1"], []
+        if category_id:
+            conditions.append("category_id = ?")
+            params.append(category_id)
+        if search:
+            match, short_terms = self._search_terms(search)
+            if match:
+                conditions.append("rowid IN (SELECT rowid FROM customers_fts WHERE customers_fts MATCH ?)")
+                params.append(match)
+            if short_terms:
+                condition, like_params = self._like_condition(short_terms, "")
+                conditions.append(condition)
+                params.extend(like_params)
+        return " AND ".join(conditions), params
+
+    def count_matching(self, category_id: Optional[int] = None, search: str = "") -> int:
+        """返回符合篩選條件的客戶數"""
+        condition, params = self._target_condition(None, category_id, search)
+        return self.conn.execute("SELECT COUNT(*) FROM customers WHERE " + condition, params).fetchone()[0]
+
+    def bulk_delete(self, ids: Optional[Iterable[str]] = None, category_id: Optional[int] = None, search: str = "") -> int:
+        """
+        批次刪除客戶。
+        :param ids: 要刪除的客戶 ID；為 None 時改為刪除符合 category_id 與 search 篩選條件的所有客戶。
+        :return: 刪除的筆數。
+        """
+        condition, params = self._target_condition(ids, category_id, search)
+        with self.conn:
+            self._log_changes("D", self.OLD_ROW_JSON, condition, params)
+            return self.conn.execute("DELETE FROM customers WHERE " + condition, params).rowcount
+
+    def bulk_move(self, new_category_id: Optional[int], ids: Optional[Iterable[str]] = None,
+                  category_id: Optional[int] = None, search: str = "") -> int:
+        """
+        批次將客戶移到另一個分類。對象的指定方式與 bulk_delete 相同。
+        :return: 實際改變分類的筆數。
+        """
+        condition, params = self._target_condition(ids, category_id, search)
+        with self.conn:
+            self._log_changes("U", "json_object('category_id', category_id)",
+                              f"{condition} AND category_id IS NOT ?", params + [new_category_id])
+            return self.conn.execute(
+                f"UPDATE customers SET category_id = ? WHERE {condition} AND category_id IS NOT ?",
+                [new_category_id] + params + [new_category_id]).rowcount
+
+    def bulk_append_notes(self, text: str, ids: Optional[Iterable[str]] = None,
+                          category_id: Optional[int] = None, search: str = "") -> int:
+        """
+        批次在客戶的備註後面附加一段文字 (原本有備註時先換行)。對象的指定方式與 bulk_delete 相同。
+        :return: 更新的筆數。
+        """
+        condition, params = self._target_condition(ids, category_id, search)
+        with self.conn:
+            self._log_changes("U", "json_object('notes', notes)", condition, params)
+            return self.conn.execute(
+                "UPDATE customers SET notes = CASE WHEN IFNULL(notes, '') = '' THEN ? ELSE notes || char(10) || ? END "
+                "WHERE " + condition, [text, text] + params).rowcount
+
+    def _page_query(self, category_id, after, before, limit, order=None, uncategorized=False, reverse=False):
+        """
+        組出 fetch_page 使用的 SQL 與參數。
+        :param uncategorized: 為 True 時只查詢沒有分類的客戶。
+        :param reverse: 為 True 時反向排序 (提供 before 時一律反向)。
+        """
+        order = order or SortOrder()
+        params = []
+        conditions = []
+        query = self.SELECT_PREVIEWS
+        if uncategorized:
+            conditions.append("c.category_id IS NULL")
+        elif category_id:
+            conditions.append("c.category_id = ?")
+            params.append(category_id)
+        if after is not None:
+            condition, keyset_params = order.keyset_condition(after)
+            conditions.append(condition)
+            params.extend(keyset_params)
+        elif before is not None:
+            condition, keyset_params = order.keyset_condition(before, reverse=True)
+            conditions.append(condition)
+            params.extend(keyset_params)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        # 往前翻頁時反向排序取最近的幾筆，再反轉回正向順序
+        query += " ORDER BY " + order.order_by(reverse=reverse or before is not None)
+        query += " LIMIT ?"
+        params.append(limit)
+        return query, params
+
+    def iter_customers(self, category_id: Optional[int] = None, chunk_size: int = 1000) -> Iterator[Customer]:
+        """
+        依 (名稱, ID) 順序逐筆產生所有客戶 (或指定分類的客戶)。
+        資料是以 fetchmany 分批從資料庫取出的，因此記憶體用量不會隨資料表大小成長。
+        """
+        params = []
+        query = self.SELECT_CUSTOMERS
+        if category_id:
+            query += " WHERE c.category_id = ?"
+            params.append(category_id)
+        query += " ORDER BY c.name, c.id"
+        cursor = self.conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield Customer(*row)
+
+# --- 檔案匯入 ---
+# 匯入檔案可使用的欄位標題 (不分大小寫、忽略空白)，對應到客戶資料的欄位
+IMPORT_HEADERS = {
+    "id": "id", "客戶id": "id",
+    "name": "name", "客戶名稱": "name",
+    "category": "category", "分類": "category",
+    "notes": "notes", "備註": "notes",
+}
+
+def _cell_text(value):
+    """將 CSV/Excel 儲存格的值轉成去除前後空白的字串 (Excel 中的整數 ID 會被讀成 1001.0 這類浮點數)"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def _iter_sheet_rows(path):
+    """逐列讀取 CSV 或 Excel (.xlsx) 檔案，產生每一列的儲存格值"""
+    if path.lower().endswith(".xlsx"):
+        try:
+            import openpyxl  # 選用套件，只有匯入 Excel 檔案時才需要
+        except ImportError as e:
+            raise ImportError("讀取 Excel 檔案需要安裝 openpyxl 套件 (pip install openpyxl)") from e
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)  # read_only 模式會以串流方式讀取
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:  # utf-8-sig 可處理 Excel 匯出的 BOM
+            yield from csv.reader(f)
+
+def read_customer_file(path):
+    """
+    以串流方式讀取要匯入的客戶檔案。第一列必須是欄位標題，至少要包含客戶 ID、名稱與分類。
+    :return: 產生 (列號, 客戶 ID, 名稱, 分類名稱, 備註) 的 generator，可直接交給 CustomerRepository.import_customers。
+    """
+    rows = _iter_sheet_rows(path)
+    header = next(rows, None) or []
+    columns = {}
+    for index, title in enumerate(header):
+        field = IMPORT_HEADERS.get(_cell_text(title).lower().replace(" ", ""))
+        if field and field not in columns:
+            columns[field] = index
+    missing = [field for field in ("id", "name", "category") if field not in columns]
+    if missing:
+        raise ValueError(f"匯入檔案缺少必要欄位：{', '.join(missing)}")
+
+    def cell(row, field):
+        index = columns.get(field)
+        return _cell_text(row[index]) if index is not None and index < len(row) else ""
+
+    for line_no, row in enumerate(rows, start=2):
+        if not any(_cell_text(value) for value in row):
+            continue  # 略過空白列
+        yield line_no, cell(row, "id"), cell(row, "name"), cell(row, "category"), cell(row, "notes")
+
+# --- 檔案匯出 ---
+EXPORT_FIELDS = ("id", "name", "category", "notes")  # 匯出檔案的欄位，與匯入檔案的欄位標題相容
+EXPORT_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl", ".parquet": "parquet"}  # 副檔名 -> 格式
+
+def export_format_for(path):
+    """依照副檔名判斷匯出格式，無法判斷時使用 CSV"""
+    return EXPORT_FORMATS.get(os.path.splitext(path)[1].lower(), "csv")
+
+def export_customers(customers, path, fmt=None, chunk_size=50000, progress=None):
+    """
+    將客戶資料串流寫入 CSV、JSON Lines 或 Parquet 檔案。
+    資料是一邊從 customers 讀取一邊寫出的，Parquet 也是每 chunk_size 筆寫成一個 row group，
+    因此記憶體用量不會隨匯出的筆數成長。
+    :param customers: Customer 的 iterable，通常是 CustomerRepository.iter_customers() 的結果。
+    :param fmt: 'csv'、'jsonl' 或 'parquet'；省略時依副檔名判斷。
+    :param progress: 每寫出 chunk_size 筆時被呼叫的函式，參數為目前已寫出的筆數。
+    :return: 寫出的總筆數。
+    """
+    fmt = fmt or export_format_for(path)
+    count = 0
+    if fmt == "parquet":
+        try:
+            import pyarrow as pa  # 選用套件，只有匯出 Parquet 檔案時才需要
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("匯出 Parquet 檔案需要安裝 pyarrow 套件 (pip install pyarrow)") from e
+        schema = pa.schema([(field, pa.string()) for field in EXPORT_FIELDS])
+        with pq.ParquetWriter(path, schema) as writer:
+            columns = {field: [] for field in EXPORT_FIELDS}
+            for customer in customers:
+                columns["id"].append(customer.id)
+                columns["name"].append(customer.name)
+                columns["category"].append(customer.category)
+                columns["notes"].append(customer.notes)
+                count += 1
+                if count % chunk_size == 0:
+                    writer.write_table(pa.table(columns, schema=schema))
+                    columns = {field: [] for field in EXPORT_FIELDS}
+                    if progress: progress(count)
+            if columns["id"]:
+                writer.write_table(pa.table(columns, schema=schema))
+    else:
+        with open(path, "w", newline="", encoding="utf-8-sig" if fmt == "csv" else "utf-8") as f:
+            if fmt == "csv":
+                writer = csv.writer(f)
+                writer.writerow(EXPORT_FIELDS)
+                write = lambda customer: writer.writerow((customer.id, customer.name, customer.category or "", customer.notes or ""))
+            else:
+                write = lambda customer: f.write(json.dumps({"id": customer.id, "name": customer.name, "category": customer.category,
+                                                             "notes": customer.notes}, ensure_ascii=False) + "\n")
+            for customer in customers:
+                write(customer)
+                count += 1
+                if progress and count % chunk_size == 0: progress(count)
+    if progress: progress(count)
+    return count
+
+# --- 效能分析 ---
+PROFILE_ENV_VAR = "CUSTOMER_MANAGER_PROFILE"  # 設定此環境變數 (值為 1 或追蹤檔路徑) 即可啟用效能分析
+DEFAULT_TRACE_FILE = "profile_trace.json"  # 效能分析追蹤檔的預設路徑
+
+def operation_name(func):
+    """
+    返回函式在效能分析中使用的名稱。lambda 與巢狀函式以定義它們的方法命名，
+    例如 CustomerApp.load_page 中送出的查詢與它的回呼都記錄為 "CustomerApp.load_page"。
+    """
+    name = getattr(func, "__qualname__", None) or repr(func)
+    return name.split(".<locals>")[0]
+
+class Profiler:
+    """
+    選擇性啟用的效能分析器。記錄每個操作的耗時與資料列數，並依 (類型, 名稱) 彙總：
+    sql (背景執行緒中的資料庫請求，包含 commit)、wait (請求在佇列中等待的時間)、
+    callback (主執行緒處理結果的時間)、render (Treeview 更新)、latency (從重新載入到第一頁顯示完成)、
+    stall (事件迴圈無法及時處理事件的時間)。
+    可以從多個執行緒同時記錄。結束時以 Chrome 追蹤格式 (chrome://tracing 或 Perfetto 可開啟) 寫入 JSON 檔。
+    """
+    MAX_EVENTS = 100_000  # 追蹤檔最多保留的事件數 (超過時捨棄最舊的事件，彙總統計不受影響)
+    HEARTBEAT_INTERVAL = 100  # 檢查事件迴圈是否卡住的間隔 (毫秒)
+    STALL_THRESHOLD = 50  # 心跳延遲超過此值 (毫秒) 時記錄為一次卡頓
+
+    def __init__(self, trace_path=DEFAULT_TRACE_FILE):
+        self.trace_path = trace_path
+        self.origin = time.perf_counter()  # 追蹤檔中時間戳記的起點
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=self.MAX_EVENTS)
+        self.stats = {}  # (類型, 名稱) -> [次數, 總耗時, 最長耗時, 資料列數]
+
+    def record(self, kind, name, start, duration, rows=None):
+        """
+        記錄一次操作。
+        :param start: 開始時間 (time.perf_counter() 的值)。
+        :param duration: 耗時 (秒)。
+        :param rows: 操作處理的資料列數，不適用時為 None。
+        """
+        event = {"name": name, "cat": kind, "ph": "X", "ts": round((start - self.origin) * 1e6),
+                 "dur": round(duration * 1e6), "pid": os.getpid(), "tid": threading.current_thread().name}
+        if rows is not None:
+            event["args"] = {"rows": rows}
+        with self.lock:
+            self.events.append(event)
+            stat = self.stats.setdefault((kind, name), [0, 0.0, 0.0, 0])
+            stat[0] += 1
+            stat[1] += duration
+            stat[2] = max(stat[2], duration)
+            stat[3] += rows or 0
+
+    @contextlib.contextmanager
+    def measure(self, kind, name, rows=None):
+        """以 with 區塊量測一段程式碼的耗時"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, start, time.perf_counter() - start, rows)
+
+    def start_heartbeat(self, root):
+        """
+        以 root.after 定期排程心跳；心跳比預定時間晚執行，代表事件迴圈在這段時間內被其他工作佔住，
+        延遲超過 STALL_THRESHOLD 時記錄為一次卡頓。
+        """
+        def beat(scheduled):
+            now = time.perf_counter()
+            delay = now - scheduled
+            if delay * 1000 >= self.STALL_THRESHOLD:
+                self.record("stall", "event loop", scheduled, delay)
+            root.after(self.HEARTBEAT_INTERVAL, beat, now + self.HEARTBEAT_INTERVAL / 1000)
+
+        root.after(self.HEARTBEAT_INTERVAL, beat, time.perf_counter() + self.HEARTBEAT_INTERVAL / 1000)
+
+    def summary(self):
+        """返回彙總統計 [(類型, 名稱, 次數, 總耗時, 平均耗時, 最長耗時, 資料列數)]，依總耗時由大到小排序 (時間單位為秒)"""
+        with self.lock:
+            rows = [(kind, name, count, total, total / count, longest, row_count)
+                    for (kind, name), (count, total, longest, row_count) in self.stats.items()]
+        return sorted(rows, key=lambda row: row[3], reverse=True)
+
+    def write_trace(self, path=None):
+        """將所有事件與彙總統計寫入 JSON 追蹤檔，返回檔案路徑"""
+        path = path or self.trace_path
+        fields = ("kind", "name", "count", "total_ms", "avg_ms", "max_ms", "rows")
+        summary = [dict(zip(fields, (kind, name, count, total * 1000, average * 1000, longest * 1000, rows)))
+                   for kind, name, count, total, average, longest, rows in self.summary()]
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"summary": summary}},
+                      f, ensure_ascii=False)
+        return path
+
+# --- 背景資料庫執行緒 ---
+class OperationCancelled(Exception):
+    """長時間的背景工作 (例如匯入或匯出) 因程式關閉而被取消"""
+
+def cancellable(iterable, cancel):
+    """逐筆產生 iterable 的內容；取消旗標 (threading.Event) 被設定時拋出 OperationCancelled"""
+    for item in iterable:
+        if cancel.is_set():
+            raise OperationCancelled()
+        yield item
+
+class _BackgroundTask:
+    """DatabaseExecutor.run_separately 啟動的一個背景工作：它的執行緒、取消旗標與資料庫連線"""
+    __slots__ = ("thread", "cancel", "repo")
+
+    def __init__(self):
+        self.thread = None
+        self.cancel = threading.Event()
+        self.repo = None
+
+    def stop(self):
+        """設定取消旗標，並中斷正在執行的 SQL"""
+        self.cancel.set()
+        repo = self.repo
+        if repo is not None:
+            try:
+                repo.conn.interrupt()
+            except sqlite3.ProgrammingError:  # 連線剛好已經關閉
+                pass
+
+class DatabaseExecutor:
+    """
+    在背景執行緒中執行資料庫工作的執行器，讓 Tk 的事件迴圈不會因為查詢或寫入而卡住。
+    工作執行緒擁有自己的 CustomerRepository (也就是自己的 SQLite 連線)，並依序處理請求佇列。
+    執行結果會放進結果佇列，由主執行緒以 root.after 定期取出並呼叫回呼函式，
+    因此所有 UI 操作仍然只在主執行緒中進行。
+    工作執行緒開啟連線時只建立讀取列表所需的基本資料表，其餘的結構遷移由呼叫端以 init_schema 請求執行；
+    請求依提交的順序處理，因此在遷移請求之後提交的請求都能使用最新的資料庫結構；
+    以 run_separately 執行的寫入工作不經過請求佇列，改為等待 migration_done 被設定後才開始。
+    """
+    POLL_INTERVAL = 20  # 主執行緒檢查結果佇列的間隔 (毫秒)
+    SHUTDOWN_TIMEOUT = 2.0  # 關閉時最多等待背景工作結束的秒數，超過時中斷它們，不讓視窗停止回應
+
+    def __init__(self, root, db_name, on_error, profiler=None):
+        """
+        :param root: Tkinter 的主視窗，用來排程結果的處理。
+        :param db_name: 資料庫檔案名稱，工作執行緒會用它建立自己的連線。
+        :param on_error: 請求沒有指定錯誤處理函式時，預設使用的錯誤回呼。
+        :param profiler: 若提供 Profiler，記錄每個請求的等待時間、執行時間、資料列數與回呼的處理時間。
+        """
+        self.root = root
+        self.db_name = db_name
+        self.default_on_error = on_error
+        self.profiler = profiler
+        self.requests = queue.Queue()  # 主執行緒 -> 工作執行緒
+        self.results = queue.Queue()  # 工作執行緒 -> 主執行緒
+        self.generations = {}  # 每個請求 key 最新的世代編號，用來判斷請求是否已經過時
+        self.running_key = None  # 工作執行緒目前正在執行的請求 key
+        self.repo = None  # 工作執行緒的 CustomerRepository，用來中斷已經過時的查詢
+        self.tasks = set()  # 以 run_separately 啟動、尚未結束的背景工作
+        self.migration_done = threading.Event()  # 結構遷移結束 (成功或失敗) 時由呼叫端設定
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="database-executor", daemon=True)
+        self.thread.start()
+        self.poll_id = self.root.after(self.POLL_INTERVAL, self._poll)
+
+    def submit(self, func, *args, on_done=None, on_error=None, key=None):
+        """
+        提交一個資料庫請求。
+        :param func: 在工作執行緒中被呼叫的函式，第一個參數是 CustomerRepository，其後為 args。
+        :param on_done: 成功時在主執行緒中被呼叫，參數為 func 的返回值。
+        :param on_error: 失敗時在主執行緒中被呼叫，參數為例外物件。
+        :param key: 若提供，同一個 key 只有最新提交的請求有效；
+                    較舊的請求若尚未執行會直接略過，正在執行的查詢會被中斷，已經執行完的結果也會被丟棄。
+        """
+        generation = self._next_generation(key) if key is not None else None
+        submitted = time.perf_counter() if self.profiler else None
+        self.requests.put((func, args, on_done, on_error or self.default_on_error, key, generation, submitted))
+
+    def run_separately(self, func, *args, on_done=None, on_error=None, name="background-task", writes=False):
+        """
+        在獨立的執行緒與資料庫連線上執行一個長時間的工作 (例如匯入、匯出或完整性檢查)。
+        它不佔用工作執行緒，因此執行期間列表的分頁、搜尋與修改都不必排在它後面等待；
+        WAL 模式下讀取不會被寫入阻擋，匯入則以小交易分批寫入，工作執行緒的寫入最多只需等待一批。
+        :param func: 第一個參數是 CustomerRepository，第二個參數是取消旗標 (threading.Event)，其後為 args。
+                     程式關閉時旗標會被設定，func 應在處理資料的迴圈中檢查它 (例如透過 cancellable)。
+        :param on_done: 成功時在主執行緒中被呼叫，參數為 func 的返回值。
+        :param on_error: 失敗 (包括被取消) 時在主執行緒中被呼叫，參數為例外物件。
+        :param writes: 工作會寫入資料時設為 True。它會等到結構遷移結束才開始，
+                       不會寫入舊版的資料表，也不會在遷移持有寫入鎖時逾時。
+        """
+        task = _BackgroundTask()
+
+        def run():
+            start = time.perf_counter()
+            result = None
+            try:
+                if writes:
+                    while not self.migration_done.wait(self.POLL_INTERVAL / 1000):
+                        if task.cancel.is_set():
+                            raise OperationCancelled()
+                task.repo = CustomerRepository(self.db_name, migrate=False)
+                try:
+                    result = func(task.repo, task.cancel, *args)
+                finally:
+                    task.repo.close()
+            except Exception as e:
+                self.results.put((on_error or self.default_on_error, (e,), None, None))
+            else:
+                self.results.put((on_done, (result,), None, None))
+            finally:
+                with self.lock:
+                    self.tasks.discard(task)
+                if self.profiler:
+                    self.profiler.record("sql", operation_name(func), start, time.perf_counter() - start,
+                                         result if type(result) is int else None)
+
+        task.thread = threading.Thread(target=run, name=name, daemon=True)
+        with self.lock:
+            self.tasks.add(task)
+        task.thread.start()
+
+    def post(self, callback, *args):
+        """從工作執行緒中排程一個在主執行緒執行的回呼 (例如回報進度)"""
+        self.results.put((callback, args, None, None))
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """
+        停止工作執行緒與所有背景工作，並關閉它們的資料庫連線。最多等待 timeout 秒：
+        背景工作會立即被取消；工作執行緒在時限內處理完已提交的請求，逾時則中斷正在執行的 SQL (該交易會被回復)。
+        所有執行緒都是 daemon，時限過後即使仍未結束也不會阻擋程式關閉；SQLite 會在下次開啟時自動復原未完成的交易。
+        """
+        self.root.after_cancel(self.poll_id)
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            tasks = list(self.tasks)
+        for task in tasks:
+            task.stop()
+        self.requests.put(None)
+        self.thread.join(timeout)
+        if self.thread.is_alive() and self.repo is not None:
+            self.repo.conn.interrupt()
+        for task in tasks:
+            task.thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _next_generation(self, key):
+        with self.lock:
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+            if key == self.running_key:
+                # 正在執行的同一類請求已經過時，中斷它的 SQL 查詢 (interrupt 可以從其他執行緒安全地呼叫)
+                self.repo.conn.interrupt()
+            return generation
+
+    def _is_stale(self, key, generation):
+        if key is None:
+            return False
+        with self.lock:
+            return self.generations.get(key) != generation
+
+    def _run(self):
+        """工作執行緒的主迴圈"""
+        try:
+            repo = self.repo = CustomerRepository(self.db_name, migrate=False)
+        except Exception as e:
+            repo, startup_error = None, e
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            func, args, on_done, on_error, key, generation, submitted = request
+            with self.lock:
+                if key is not None and self.generations.get(key) != generation:
+                    continue  # 已經有更新的同類請求，略過這一個
+                self.running_key = key
+            start = time.perf_counter()
+            result = None
+            try:
+                if repo is None:
+                    raise startup_error
+                result = func(repo, *args)
+            except Exception as e:
+                self.results.put((on_error, (e,), key, generation))
+            else:
+                self.results.put((on_done, (result,), key, generation))
+            finally:
+                with self.lock:
+                    self.running_key = None
+                if self.profiler:
+                    name = operation_name(func)
+                    rows = len(result) if isinstance(result, list) else result if type(result) is int else None
+                    self.profiler.record("wait", name, submitted, start - submitted)
+                    self.profiler.record("sql", name, start, time.perf_counter() - start, rows)
+        if repo is not None:
+            repo.close()
+
+    def _poll(self):
+        """
+        在主執行緒中取出所有已完成的結果並呼叫對應的回呼。
+        回呼拋出的例外交給 Tk 的 report_callback_exception 回報，不會中斷其他結果的處理，
+        下一次檢查也一定會被排程，否則之後所有的資料庫結果都會被默默丟棄。
+        """
+        try:
+            while True:
+                try:
+                    callback, args, key, generation = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                if callback is None or self._is_stale(key, generation):
+                    continue
+                try:
+                    if self.profiler:
+                        with self.profiler.measure("callback", operation_name(callback)):
+                            callback(*args)
+                    else:
+                        callback(*args)
+                except Exception:
+                    self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            self.poll_id = self.root.after(self.POLL_INTERVAL, self._poll)
+
+# --- 列表快取 ---
+class CustomerCache:
+    """
+    客戶列表視窗中目前已載入的客戶資料快取。
+    以客戶 ID 為索引保存 Customer 記錄 (NamedTuple 沒有 __dict__，每筆只佔一個 tuple 的空間)，
+    同時維護一個依分頁鍵排序、順序與 Treeview 列完全相同的鍵列表，以及每個分類的客戶 ID 集合。
+    單筆新增、修改或刪除時，可以據此以二分搜尋找出要更新的 Treeview 列，而不必重新查詢整個列表。
+    """
+    def __init__(self):
+        self.records = {}  # 客戶 ID -> Customer
+        self.keys = {}  # 客戶 ID -> 分頁鍵
+        self.sorted_keys = []  # 依序排列的 (分頁鍵, 客戶 ID)
+        self.by_category = {}  # 分類 ID -> 客戶 ID 的集合
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, cust_id):
+        return cust_id in self.records
+
+    def get(self, cust_id):
+        """返回快取中的客戶記錄，不在目前視窗中時返回 None"""
+        return self.records.get(cust_id)
+
+    def key_of(self, cust_id):
+        """返回客戶的分頁鍵"""
+        return self.keys[cust_id]
+
+    def first_key(self):
+        return self.sorted_keys[0][0]
+
+    def last_key(self):
+        return self.sorted_keys[-1][0]
+
+    def position(self, key, cust_id):
+        """返回具有此分頁鍵的客戶在列表中應有的位置"""
+        return bisect.bisect_left(self.sorted_keys, (key, cust_id))
+
+    def add(self, record, key):
+        """加入一筆客戶記錄，並返回它在列表中的位置"""
+        index = self.position(key, record.id)
+        self.sorted_keys.insert(index, (key, record.id))
+        self.records[record.id] = record
+        self.keys[record.id] = key
+        self.by_category.setdefault(record.category_id, set()).add(record.id)
+        return index
+
+    def replace(self, record):
+        """以新的內容取代一筆客戶記錄 (分頁鍵不變)"""
+        old = self.records[record.id]
+        if old.category_id != record.category_id:
+            self.by_category[old.category_id].discard(record.id)
+            self.by_category.setdefault(record.category_id, set()).add(record.id)
+        self.records[record.id] = record
+
+    def remove(self, cust_id):
+        """移除一筆客戶記錄，並返回被移除的記錄"""
+        record = self.records.pop(cust_id)
+        key = self.keys.pop(cust_id)
+        del self.sorted_keys[self.position(key, cust_id)]
+        self.by_category[record.category_id].discard(cust_id)
+        return record
+
+    def ids_in_category(self, category_id):
+        """返回目前視窗中屬於此分類的客戶 ID"""
+        return set(self.by_category.get(category_id, ()))
+
+class LRUCache:
+    """
+    容量固定的 LRU 快取：超過容量時移除最久沒有被使用的項目。
+    用來保存最近開啟過詳細資料的完整客戶記錄，再次開啟同一位客戶時不必重新查詢資料庫。
+    """
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.items = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        """返回快取中的值並標記為最近使用，不存在時返回 None"""
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """加入或更新一個項目，必要時移除最久沒有被使用的項目"""
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+
+    def pop(self, key):
+        """移除一個項目 (不存在時不做任何事)"""
+        self.items.pop(key, None)
+
+    def clear(self):
+        self.items.clear()
+
+# --- 主應用程式類別 ---
+class CustomerApp:
+    """
+    客戶管理應用程式的主類別。
+    這個類別封裝了所有與應用程式相關的資料和功能，
+    包括 UI 介面、資料庫操作和事件處理。
+    """
+    # --- 視窗化列表的設定 ---
+    # 客戶列表只保留目前畫面附近的一小段資料列，捲動到邊界時才向資料庫要下一頁或上一頁
+    MIN_PAGE_SIZE = 50  # 每頁最少的資料列數
+    SEARCH_DELAY = 250  # 停止輸入多久 (毫秒) 之後才送出搜尋
+    COLUMN_TITLES = {"id": "客戶 ID", "name": "客戶名稱", "category": "分類", "notes": "備註"}  # 列表欄位標題
+    WINDOW_PAGES = 3  # Treeview 中最多同時保留幾頁資料，超過的部分會從另一端移除
+    ROW_HEIGHT = 20  # Treeview 每一列的概略高度 (像素)，用來估算畫面可顯示的列數
+    DETAILS_CACHE_SIZE = 64  # 最多快取幾位最近開啟過詳細資料的客戶
+    STATS_REFRESH = 1000  # 效能統計視窗的更新間隔 (毫秒)
+
+    def __init__(self, root, db_name="database.db", profiler=None):
+        """
+        類別的初始化函式 (建構子)。
+        當一個 CustomerApp 物件被建立時，這個函式會被自動呼叫。
+        :param root: Tkinter 的主視窗 (Tk) 物件。
+        :param db_name: 資料庫檔案名稱。
+        :param profiler: 若提供 Profiler，記錄資料庫請求、列表更新與事件迴圈卡頓的耗時 (預設不啟用)。
+        """
+        # --- 基礎設定 ---
+        self.root = root  # 將主視窗物件儲存為實例變數
+        self.root.title("簡易客戶分級系統")  # 設定視窗標題
+        self.root.geometry("850x600")  # 設定視窗的初始大小
+
+        # --- 實例變數 ---
+        self.db_name = db_name  # 資料庫檔案名稱
+        self.details_window = None  # 用來追蹤詳細資料視窗是否存在，避免重複開啟
+        self.bulk_window = None  # 用來追蹤批次操作視窗是否存在，避免重複開啟
+        self.stats_window = None  # 用來追蹤效能統計視窗是否存在，避免重複開啟
+        self.profiler = profiler  # 效能分析器，未啟用時為 None
+        self.load_started = None  # 重新載入列表的開始時間，用來量測到第一頁顯示完成的延遲 (只在效能分析時使用)
+        self.categories = {}  # 分類名稱 -> 分類 ID，在分類載入完成後填入
+        self.filter_category_ids = [None]  # 篩選下拉選單每個選項對應的分類 ID (第一項為全部顯示)
+        self.current_category_id = None  # 目前列表所套用的分類篩選 (None 代表全部)
+        self.current_search = ""  # 目前列表所套用的搜尋文字 (空字串代表不搜尋)
+        self.search_after_id = None  # 延遲搜尋的排程 ID，用於輸入時的 debounce
+        self.sort_keys = [("name", False)]  # 使用者選擇的排序欄位 (欄位, 是否遞減)，點擊欄位標題時改變
+        self.sort_order = SortOrder(self.sort_keys)  # 實際的排序方式 (含客戶 ID 決勝鍵)，排序與分頁都交給 SQL
+        # Treeview 中每一列的客戶資料與分頁鍵：一般列表為 (客戶名稱, 客戶 ID)，搜尋時為結果中的位置
+        self.cache = CustomerCache()
+        # 列表中只有備註的預覽；詳細資料視窗開啟時才依客戶 ID 讀取完整記錄，並保留最近開啟過的幾筆
+        self.details_cache = LRUCache(self.DETAILS_CACHE_SIZE)
+        self.has_more_before = False  # 目前視窗的上方是否還有尚未載入的資料
+        self.has_more_after = False  # 目前視窗的下方是否還有尚未載入的資料
+        self.loading_page = False  # 是否正在載入分頁，避免捲動事件重複觸發
+
+        # --- 程式啟動流程 ---
+        # 建立背景資料庫執行緒，所有 SQL 都在它自己的連線上執行，不會阻塞 UI
+        self.db = DatabaseExecutor(self.root, self.db_name, on_error=self.show_db_error, profiler=self.profiler)
+        if self.profiler: self.profiler.start_heartbeat(self.root)  # 偵測事件迴圈的卡頓
+        self.create_widgets()  # 建立所有 UI 元件
+        # 第一頁客戶資料最先送出，它只需要基本的資料表，因此不論資料表多大或是否需要升級都能立即顯示；
+        # 結構遷移排在它之後，分類資料等其他請求則排在遷移之後 (工作執行緒依序處理請求)
+        self.load_customers()  # 從資料庫載入客戶資料
+        self.upgrade_database()  # 在背景升級資料庫結構，完成後載入分類資料並檢查資料庫完整性
+
+    def upgrade_database(self):
+        """在背景執行尚未套用的資料庫結構遷移，並在狀態列顯示進度"""
+        self.start_progress("正在準備資料庫...")
+
+        def migrate(repo):
+            # progress 在工作執行緒中被呼叫，透過 post 交給主執行緒更新狀態列
+            return repo.init_schema(progress=lambda done, total: self.db.post(
+                self.status_label.config, {"text": f"正在升級資料庫結構 ({done}/{total})..."}))
+
+        def on_error(e):
+            self.db.migration_done.set()  # 不再讓等待中的寫入工作停住，它們會回報實際的錯誤
+            self.stop_progress("資料庫升級失敗")
+            messagebox.showerror("資料庫錯誤", f"升級資料庫結構時發生錯誤: {e}")
+
+        self.db.submit(migrate, on_done=lambda _: self.on_database_ready(), on_error=on_error)
+
+    def on_database_ready(self):
+        """資料庫結構已是最新版本：放行等待中的寫入工作、載入分類資料，並在另一個執行緒中檢查資料庫完整性"""
+        self.db.migration_done.set()
+        self.load_categories()
+        self.status_label.config(text="正在檢查資料庫完整性...")
+        # 使用獨立的連線，WAL 模式下讀取不會阻擋工作執行緒的查詢與寫入，檢查期間列表仍可正常操作
+        self.db.run_separately(lambda repo, cancel: repo.check_integrity(), on_done=self.show_integrity_result,
+                               on_error=lambda e: self.show_integrity_result([str(e)]), name="integrity-check")
+
+    def show_integrity_result(self, problems):
+        """顯示資料庫完整性檢查的結果"""
+        if not problems:
+            self.stop_progress()
+            return
+        self.stop_progress("資料庫完整性檢查發現問題")
+        messagebox.showwarning("資料庫完整性", "資料庫檔案可能已損毀，建議盡快備份：\n" + "\n".join(problems[:10]))
 
     def create_widgets(self):
         """
         負責建立應用程式中所有的使用者介面 (UI) 元件。
         """
+        # --- 狀態列：顯示背景工作 (例如匯入) 的進度 ---
+        status_frame = ttk.Frame(self.root, padding=(10, 0, 10, 5))
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_label = ttk.Label(status_frame, text="")
+        self.status_label.pack(side=tk.LEFT)
+        self.progress_bar = ttk.Progressbar(status_frame, mode="indeterminate", length=150)  # 只在工作進行中顯示
+
         # --- 主框架，作為所有元件的容器 ---
         main_frame = ttk.Frame(self.root, padding="10")
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -104,7 +1596,7 @@ class CustomerApp:
 
         # --- 2. 分類管理區塊 ---
         category_frame = ttk.LabelFrame(left_frame, text="分類管理", padding="10")
-        category_frame.pack(fill=tk.X)
+        category_frame.pack(fill=tk.X, pady=(0, 10))
         ttk.Label(category_frame, text="新分類名稱:").grid(row=0, column=0, sticky="w", pady=2)
         self.new_category_entry = ttk.Entry(category_frame, width=30)
         self.new_category_entry.grid(row=0, column=1, sticky="ew", pady=2)
@@ -115,6 +1607,18 @@ class CustomerApp:
         del_cat_btn = ttk.Button(btn_frame, text="刪除選定分類", command=self.delete_category)
         del_cat_btn.pack(side=tk.LEFT)
 
+        # --- 3. 分類統計區塊 ---
+        stats_frame = ttk.LabelFrame(left_frame, text="分類統計", padding="10")
+        stats_frame.pack(fill=tk.BOTH, expand=True)
+        self.stats_tree = ttk.Treeview(stats_frame, columns=("category", "count"), show="headings", height=6)
+        self.stats_tree.heading("category", text="分類")
+        self.stats_tree.heading("count", text="客戶數")
+        self.stats_tree.column("category", width=150)
+        self.stats_tree.column("count", width=80, anchor="e")
+        self.stats_tree.pack(fill=tk.BOTH, expand=True)
+        self.total_label = ttk.Label(stats_frame, text="")
+        self.total_label.pack(anchor="e", pady=(5, 0))
+
         # --- 右側框架：包含客戶列表和篩選功能 ---
         right_frame = ttk.LabelFrame(main_frame, text="客戶列表", padding="10")
         right_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
@@ -128,23 +1632,25 @@ class CustomerApp:
         apply_filter_btn = ttk.Button(filter_frame, text="篩選", command=self.apply_filter)
         apply_filter_btn.pack(side=tk.LEFT, padx=(0, 5))
         clear_filter_btn = ttk.Button(filter_frame, text="顯示全部", command=self.clear_filter)
-        clear_filter_btn.pack(side=tk.LEFT)
+        clear_filter_btn.pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Label(filter_frame, text="搜尋:").pack(side=tk.LEFT, padx=(0, 5))
+        self.search_entry = ttk.Entry(filter_frame, width=20)
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.search_entry.bind("<KeyRelease>", self.on_search_changed)  # 邊輸入邊搜尋
 
         # --- 客戶列表 (使用 Treeview 元件) ---
         columns = ("id", "name", "category", "notes")
         self.tree = ttk.Treeview(right_frame, columns=columns, show="headings")
-        self.tree.heading("id", text="客戶 ID")
-        self.tree.heading("name", text="客戶名稱")
-        self.tree.heading("category", text="分類")
-        self.tree.heading("notes", text="備註")
+        self.update_headings()  # 設定欄位標題 (含排序方向的標示)
         self.tree.column("id", width=100)
         self.tree.column("name", width=120)
         self.tree.column("category", width=100)
         self.tree.column("notes", width=200)
-        scrollbar = ttk.Scrollbar(right_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
+        self.scrollbar = ttk.Scrollbar(right_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        # 捲動時先經過 on_tree_scroll，以便在接近邊界時載入相鄰的分頁
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, pady=(5,0))
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
         # --- 修改與刪除按鈕區 ---
         action_frame = ttk.Frame(right_frame)
@@ -152,16 +1658,28 @@ class CustomerApp:
         edit_btn = ttk.Button(action_frame, text="修改選定客戶", command=self.open_details_window)
         edit_btn.pack(side=tk.LEFT, padx=(0, 5))
         delete_btn = ttk.Button(action_frame, text="刪除選定客戶", command=self.delete_customer)
-        delete_btn.pack(side=tk.LEFT)
+        delete_btn.pack(side=tk.LEFT, padx=(0, 5))
+        import_btn = ttk.Button(action_frame, text="匯入客戶...", command=self.import_customers)
+        import_btn.pack(side=tk.LEFT, padx=(0, 5))
+        export_btn = ttk.Button(action_frame, text="匯出列表...", command=self.export_customers)
+        export_btn.pack(side=tk.LEFT, padx=(0, 5))
+        bulk_btn = ttk.Button(action_frame, text="批次操作...", command=self.open_bulk_window)
+        bulk_btn.pack(side=tk.LEFT)
+        if self.profiler:  # 只在啟用效能分析時顯示
+            stats_btn = ttk.Button(action_frame, text="效能統計...", command=self.open_stats_window)
+            stats_btn.pack(side=tk.RIGHT)
 
         # --- 設定右鍵選單 ---
         self.context_menu = tk.Menu(self.root, tearoff=0)
         self.context_menu.add_command(label="修改選定客戶", command=self.open_details_window)
         self.context_menu.add_command(label="刪除選定客戶", command=self.delete_customer)
+        self.context_menu.add_separator()
+        self.context_menu.add_command(label="批次操作...", command=self.open_bulk_window)
 
         # --- 綁定事件 ---
         self.tree.bind("<Button-3>", self.show_context_menu)  # 綁定滑鼠右鍵點擊事件
         self.tree.bind("<Double-1>", self.on_double_click)  # 綁定滑鼠左鍵雙擊事件
+        self.tree.bind("<Button-1>", self.on_tree_click)  # 點擊欄位標題排序，按住 Shift 點擊可加入次要排序
 
     # --- 事件處理函式 ---
     def on_double_click(self, event):
@@ -175,9 +1693,39 @@ class CustomerApp:
         """在滑鼠點擊的位置顯示右鍵選單"""
         selection = self.tree.identify_row(event.y)
         if selection:
-            self.tree.selection_set(selection)
+            if selection not in self.tree.selection():  # 在已選取的多列上按右鍵時保留整個選取範圍
+                self.tree.selection_set(selection)
             self.context_menu.post(event.x_root, event.y_root)
-    
+
+    def on_tree_click(self, event):
+        """點擊欄位標題時依該欄位排序；按住 Shift 點擊則加入 (或反轉) 次要排序欄位"""
+        if self.tree.identify_region(event.x, event.y) != "heading":
+            return
+        column_index = int(self.tree.identify_column(event.x)[1:]) - 1  # identify_column 返回 '#1' 這樣的字串
+        column = self.tree["columns"][column_index]
+        self.sort_by(column, add=bool(event.state & 0x0001))  # 0x0001 代表 Shift 鍵
+
+    def on_search_changed(self, event):
+        """搜尋框內容改變時，延遲一小段時間再搜尋，避免每按一個鍵就查詢一次"""
+        if self.search_after_id:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(self.SEARCH_DELAY, self.apply_search)
+
+    def on_tree_scroll(self, first, last):
+        """
+        Treeview 的捲動回呼。除了更新捲軸位置之外，
+        當畫面捲到目前視窗的頂端或底端時，排程載入上一頁或下一頁。
+        """
+        self.scrollbar.set(first, last)
+        if self.loading_page:
+            return
+        if float(last) >= 1.0 and self.has_more_after:
+            self.loading_page = True
+            self.root.after_idle(self.load_page, 'next')
+        elif float(first) <= 0.0 and self.has_more_before:
+            self.loading_page = True
+            self.root.after_idle(self.load_page, 'prev')
+
     # --- 核心邏輯函式 ---
     def open_details_window(self, mode='edit'):
         """
@@ -194,8 +1742,26 @@ class CustomerApp:
                 messagebox.showwarning("操作錯誤", "請先在列表中選擇一位客戶。")
             return
 
-        customer_data = self.tree.item(selected_item, 'values')
-        cust_id, name, category, notes = customer_data
+        cust_id = selected_item[0]  # Treeview 列的 iid 就是客戶 ID
+        record = self.details_cache.get(cust_id)
+        if record:
+            self.show_details_window(record, mode)  # 最近開啟過的客戶，直接使用快取的完整記錄
+            return
+
+        def on_done(record):
+            if not record:
+                messagebox.showwarning("操作錯誤", f"客戶 (ID: {cust_id}) 已不存在。")
+                return
+            self.details_cache.put(cust_id, record)
+            if not (self.details_window and self.details_window.winfo_exists()):
+                self.show_details_window(record, mode)
+
+        # 列表中的備註只是預覽，完整的資料依客戶 ID 從資料庫讀取 (連續點擊時只保留最後一次請求)
+        self.db.submit(CustomerRepository.get_customer, cust_id, on_done=on_done, key='details')
+
+    def show_details_window(self, record, mode):
+        """以完整的客戶記錄建立詳細資料視窗"""
+        cust_id, name, category, notes = record.id, record.name, record.category or "", record.notes or ""
 
         # 建立一個 Toplevel 視窗，它是一個獨立於主視窗的新視窗
         self.details_window = tk.Toplevel(self.root)
@@ -231,50 +1797,349 @@ class CustomerApp:
                                       self.details_window, cust_id, name_entry, cat_combobox, notes_text
                                   ))
             save_btn.grid(row=4, column=1, sticky="e", pady=10)
+            # 查看這位客戶的變更記錄，並可還原到先前的版本
+            history_btn = ttk.Button(frame, text="變更記錄...", command=lambda: self.open_history_window(cust_id))
+            history_btn.grid(row=4, column=0, sticky="w", pady=10)
         else: # 'view' mode
             # 在 'view' 模式下，顯示 "關閉" 按鈕
             close_btn = ttk.Button(frame, text="關閉", command=self.details_window.destroy)
             close_btn.grid(row=4, column=1, sticky="e", pady=10)
             
+    def open_history_window(self, cust_id):
+        """打開一位客戶的變更記錄視窗：列出每次變更的時間、使用者與內容，並可還原為選取的版本"""
+        parent = self.details_window if self.details_window and self.details_window.winfo_exists() else self.root
+        history_win = tk.Toplevel(parent)
+        history_win.title(f"變更記錄 - {cust_id}")
+        frame = ttk.Frame(history_win, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        history_tree = ttk.Treeview(frame, columns=("time", "user", "op", "changes"), show="headings", height=10)
+        for column, title, width in (("time", "時間", 140), ("user", "使用者", 80), ("op", "動作", 50), ("changes", "變更內容", 360)):
+            history_tree.heading(column, text=title)
+            history_tree.column(column, width=width)
+        history_tree.pack(fill=tk.BOTH, expand=True)
+        status_label = ttk.Label(frame, text="正在載入變更記錄...")
+        status_label.pack(side=tk.LEFT, pady=(10, 0))
+        versions = {}  # Treeview 列的 iid (變更記錄 ID) -> 這次變更後的版本
+
+        def on_done(entries):
+            if not history_win.winfo_exists(): return
+            for entry in entries:
+                iid = str(entry.id)
+                versions[iid] = entry.after
+                history_tree.insert("", tk.END, iid=iid, values=(
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.timestamp)), entry.user,
+                    {"I": "新增", "U": "修改", "D": "刪除"}[entry.op], self.describe_change(entry.before, entry.after)))
+            status_label.config(text=f"共 {len(entries):,} 筆變更記錄" if entries else "沒有變更記錄")
+
+        def restore():
+            selected = history_tree.selection()
+            if not selected:
+                messagebox.showwarning("操作錯誤", "請先選擇要還原的版本。", parent=history_win); return
+            version = versions[selected[0]]
+            if version is None:
+                messagebox.showwarning("操作錯誤", "這筆記錄之後客戶已被刪除，請選擇其他版本。", parent=history_win); return
+            if messagebox.askyesno("確認還原", "確定要將客戶資料還原為此版本嗎？\n目前的資料會被記錄在變更記錄中。", parent=history_win):
+                self.restore_customer_version(history_win, cust_id, version)
+
+        ttk.Button(frame, text="還原此版本", command=restore).pack(side=tk.RIGHT, pady=(10, 0))
+        self.db.submit(CustomerRepository.customer_history, cust_id, on_done=on_done)
+
+    def describe_change(self, before, after):
+        """返回一次變更的簡短說明，例如「分類: VIP 客戶 → 活躍客戶」"""
+        if before is None or after is None:
+            return ""
+        category_names = {cat_id: name for name, cat_id in self.categories.items()}
+        def show(field, value):
+            if field == "category_id":
+                return "(無)" if value is None else category_names.get(value, "(已刪除的分類)")
+            return (value or "")[:NOTES_PREVIEW_LENGTH]
+        titles = {"name": "名稱", "category_id": "分類", "notes": "備註"}
+        return "；".join(f"{titles[field]}: {show(field, before.get(field))} → {show(field, after.get(field))}"
+                        for field in CustomerRepository.HISTORY_FIELDS if before.get(field) != after.get(field))
+
+    def restore_customer_version(self, history_win, cust_id, version):
+        """將客戶還原為變更記錄中的版本，並更新列表與分類統計"""
+        def on_done(record):
+            for window in (history_win, self.details_window):
+                if window and window.winfo_exists(): window.destroy()
+            old = self.cache.get(cust_id)
+            self.details_cache.put(cust_id, record)
+            self.patch_update(record.preview())
+            if not old or old.category_id != record.category_id: self.load_categories()  # 分類改變時更新分類統計
+            messagebox.showinfo("成功", "客戶資料已還原！")
+
+        self.db.submit(CustomerRepository.restore_customer, cust_id, version, on_done=on_done)
+
     # --- 資料庫操作函式 ---
     def load_categories(self):
-        """從資料庫載入所有分類，並更新 UI 上的下拉選單"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT id, name FROM categories ORDER BY name")
+        """
+        從資料庫載入所有分類與各分類的客戶數，完成後更新 UI 上的下拉選單與分類統計。
+        客戶數由彙總表提供，因此每次客戶資料變更後都可以直接呼叫這個函式更新統計。
+        """
+        self.db.submit(CustomerRepository.category_counts, on_done=self.show_categories, key='categories')
+
+    def show_categories(self, counts):
+        """以查詢到的分類與客戶數更新 UI 上的下拉選單與分類統計"""
+        with self.measure("render", "show_categories", len(counts[0])):
+            self._show_categories(counts)
+
+    def _show_categories(self, counts):
+        """show_categories 的實際內容"""
+        categories, uncategorized = counts
         # 使用字典推導式，建立一個 "分類名稱 -> 分類ID" 的對應字典
-        self.categories = {name: cat_id for cat_id, name in cursor.fetchall()}
+        self.categories = {name: cat_id for cat_id, name, _ in categories}
         category_names = list(self.categories.keys())
+        selected_name = self.category_combobox.get()
         self.category_combobox['values'] = category_names
-        if category_names: self.category_combobox.current(0)
-        filter_category_names = ["— 全部顯示 —"] + category_names
+        if selected_name in self.categories: self.category_combobox.set(selected_name)  # 保留新增客戶時選擇的分類
+        elif category_names: self.category_combobox.current(0)
+        # 篩選下拉選單在分類名稱旁顯示客戶數；選項的順序與 filter_category_ids 相同
+        total = sum(count for _, _, count in categories) + uncategorized
+        filter_category_names = [f"— 全部顯示 — ({total:,})"] + [f"{name} ({count:,})" for _, name, count in categories]
+        self.filter_category_ids = [None] + [cat_id for cat_id, _, _ in categories]
         self.filter_category_combobox['values'] = filter_category_names
-        if filter_category_names: self.filter_category_combobox.current(0)
+        # 保留目前的篩選選項，列表才會與下拉選單一致
+        if self.current_category_id in self.filter_category_ids:
+            self.filter_category_combobox.current(self.filter_category_ids.index(self.current_category_id))
+        else:
+            self.filter_category_combobox.current(0)
+        # 分類統計
+        self.stats_tree.delete(*self.stats_tree.get_children())
+        for _, name, count in categories:
+            self.stats_tree.insert("", tk.END, values=(name, f"{count:,}"))
+        if uncategorized:
+            self.stats_tree.insert("", tk.END, values=("(未分類)", f"{uncategorized:,}"))
+        self.total_label.config(text=f"客戶總數：{total:,}")
     
     def load_customers(self, category_id=None):
-        """從資料庫載入客戶資料，並顯示在 Treeview 列表中。可選擇性地依分類 ID 篩選"""
-        for item in self.tree.get_children(): self.tree.delete(item)
-        cursor = self.conn.cursor()
-        params = []
-        query = "SELECT c.id, c.name, cat.name, c.notes FROM customers c LEFT JOIN categories cat ON c.category_id = cat.id"
-        if category_id:
-            query += " WHERE c.category_id = ?"
-            params.append(category_id)
-        query += " ORDER BY c.name"
-        cursor.execute(query, params)
-        for row in cursor.fetchall(): self.tree.insert("", tk.END, values=row)
+        """
+        從資料庫載入客戶資料，並顯示在 Treeview 列表中。可選擇性地依分類 ID 篩選。
+        列表採用視窗化顯示：這裡只會載入第一頁，其餘資料在使用者捲動時才分頁載入，
+        因此重新整理的成本只與畫面高度有關，而不是整個資料表的大小。
+        """
+        self.current_category_id = category_id
+        if self.profiler: self.load_started = time.perf_counter()
+        with self.measure("render", "clear_list", len(self.cache)):
+            self.tree.delete(*self.tree.get_children())  # 一次刪除所有列，而不是逐列呼叫
+        self.cache = CustomerCache()
+        self.has_more_before = False
+        self.has_more_after = True
+        self.load_page('next')
+
+    def page_size(self):
+        """依照 Treeview 目前的高度估算一頁要載入的資料列數"""
+        visible_rows = self.tree.winfo_height() // self.ROW_HEIGHT
+        return max(self.MIN_PAGE_SIZE, visible_rows * 2)
+
+    def load_page(self, direction):
+        """
+        在背景載入與目前視窗相鄰的一頁資料。
+        所有分頁請求共用同一個 key，因此重新篩選時，尚未完成的舊分頁請求會自動被取消。
+        :param direction: 'next' 代表向下載入，'prev' 代表向上載入。
+        """
+        limit = self.page_size()
+        children = self.tree.get_children()
+        if direction == 'next':
+            after = self.page_key(children[-1]) if children else None
+            kwargs = {'after': after}
+        else:
+            if not children:
+                self.loading_page = False
+                return
+            kwargs = {'before': self.page_key(children[0])}
+        self.loading_page = True
+
+        def on_error(e):
+            self.loading_page = False
+            self.show_db_error(e)
+
+        category_id = self.current_category_id
+        search = self.current_search
+        order = self.sort_order
+        if search:
+            # 搜尋結果依相關性排序，分頁鍵是結果中的位置
+            def on_done(rows):
+                if direction == 'next':
+                    start = kwargs['after'] + 1 if kwargs['after'] is not None else 0
+                else:
+                    start = kwargs['before'] - len(rows)
+                self.show_page(direction, rows, range(start, start + len(rows)), limit)
+            self.db.submit(lambda repo: repo.search_page(search, category_id, limit=limit, **kwargs),
+                           on_done=on_done, on_error=on_error, key='page')
+        else:
+            self.db.submit(lambda repo: repo.fetch_page(category_id, limit=limit, order=order, **kwargs),
+                           on_done=lambda rows: self.show_page(direction, rows, [order.sort_key(row) for row in rows], limit),
+                           on_error=on_error, key='page')
+
+    def page_key(self, cust_id):
+        """返回列表中一位客戶的分頁鍵：搜尋時是結果中的位置，否則是它在各排序欄位的值"""
+        if self.current_search:
+            return self.cache.key_of(cust_id)
+        return self.sort_order.values(self.cache.get(cust_id))
+
+    def show_page(self, direction, rows, keys, limit):
+        """
+        將載入的分頁加入 Treeview，並移除另一端超出視窗上限的資料列。
+        :param keys: 每一列在列表快取中的排序鍵 (搜尋時為結果中的位置)。
+        """
+        try:
+            with self.measure("render", "show_page", len(rows)):
+                self._show_page(direction, rows, keys, limit)
+        finally:
+            self.loading_page = False
+        if self.load_started is not None:
+            # 重新載入 (篩選、排序、搜尋或新增後) 到第一頁顯示完成的總時間
+            self.profiler.record("latency", "load_customers", self.load_started,
+                                 time.perf_counter() - self.load_started, len(rows))
+            self.load_started = None
+
+    def _show_page(self, direction, rows, keys, limit):
+        """show_page 的實際內容：插入資料列並維持視窗大小"""
+        children = self.tree.get_children()
+        if direction == 'next':
+            self.has_more_after = len(rows) == limit
+            for row, key in zip(rows, keys):
+                self.tree.insert("", tk.END, iid=row.id, values=row.tree_values())
+                self.cache.add(row, key)
+            overflow = children[:max(0, len(children) + len(rows) - limit * self.WINDOW_PAGES)]
+            if overflow:
+                self.remove_rows(overflow)
+                self.has_more_before = True
+                self.tree.yview_scroll(-len(overflow), 'units')  # 補償移除上方資料列所造成的畫面跳動
+        else:
+            self.has_more_before = len(rows) == limit
+            for index, (row, key) in enumerate(zip(rows, keys)):
+                self.tree.insert("", index, iid=row.id, values=row.tree_values())
+                self.cache.add(row, key)
+            overflow = children[max(0, limit * self.WINDOW_PAGES - len(rows)):]
+            if overflow:
+                self.remove_rows(overflow)
+                self.has_more_after = True
+            self.tree.yview_scroll(len(rows), 'units')  # 讓原本在最上方的資料列維持在原位
+
+    def remove_rows(self, items):
+        """從 Treeview 與列表快取中移除指定的資料列"""
+        self.tree.delete(*items)
+        for item in items: self.cache.remove(item)
+
+    # --- 單筆變更後的列表更新 ---
+    # 新增、修改、刪除單一客戶後，只更新列表快取與受影響的那一列，而不是重新載入整個列表。
+    # 搜尋結果依相關性排序，無法在本地判斷新位置，因此搜尋時改為重新載入第一頁。
+    def key_in_window(self, key):
+        """判斷分頁鍵是否落在目前已載入的視窗範圍內 (視窗之外的資料會在捲動時自然載入)"""
+        if not self.cache:
+            return not self.has_more_before and not self.has_more_after
+        return ((not self.has_more_before or key >= self.cache.first_key()) and
+                (not self.has_more_after or key <= self.cache.last_key()))
+
+    def patch_insert(self, record):
+        """若新客戶符合目前的篩選條件且落在視窗範圍內，將它插入到排序後應有的位置"""
+        if self.current_search:
+            self.load_customers(self.current_category_id)
+            return
+        if self.current_category_id and record.category_id != self.current_category_id:
+            return
+        key = self.sort_order.sort_key(record)
+        if self.key_in_window(key):
+            index = self.cache.add(record, key)
+            self.tree.insert("", index, iid=record.id, values=record.tree_values())
+
+    def patch_update(self, record):
+        """更新一位客戶在列表中的資料列；排序鍵改變時會移到新的位置"""
+        old = self.cache.get(record.id)
+        if self.current_search:
+            if old: self.load_customers(self.current_category_id)
+            return
+        same_key = old and self.sort_order.sort_key(old) == self.sort_order.sort_key(record)
+        if same_key and (not self.current_category_id or record.category_id == self.current_category_id):
+            self.cache.replace(record)  # 排序鍵不變，只更新這一列的內容
+            self.tree.item(record.id, values=record.tree_values())
+        else:
+            self.patch_remove(record.id)
+            self.patch_insert(record)
+
+    def patch_remove(self, cust_id):
+        """從列表中移除一位客戶 (若它在目前的視窗中)"""
+        if self.current_search:
+            # 搜尋結果的分頁鍵是結果中的位置，移除一列會讓之後的位置全部錯開，因此重新載入第一頁
+            if cust_id in self.cache: self.load_customers(self.current_category_id)
+            return
+        if cust_id in self.cache:
+            self.cache.remove(cust_id)
+            self.tree.delete(cust_id)
+
+    def start_progress(self, text):
+        """在狀態列顯示工作說明與進度條"""
+        self.status_label.config(text=text)
+        self.progress_bar.pack(side=tk.RIGHT)
+        self.progress_bar.start()
+
+    def stop_progress(self, text=""):
+        """停止並隱藏狀態列的進度條"""
+        self.progress_bar.stop()
+        self.progress_bar.pack_forget()
+        self.status_label.config(text=text)
+
+    def measure(self, kind, name, rows=None):
+        """返回量測一段程式碼耗時的 context manager；沒有啟用效能分析時不做任何事"""
+        return self.profiler.measure(kind, name, rows) if self.profiler else contextlib.nullcontext()
+
+    def show_db_error(self, error):
+        """背景資料庫請求失敗時的預設錯誤處理函式"""
+        messagebox.showerror("資料庫錯誤", f"發生錯誤: {error}")
 
     def apply_filter(self):
         """篩選按鈕的處理函式"""
-        selected_category_name = self.filter_category_combobox.get()
-        if selected_category_name == "— 全部顯示 —":
+        selected_index = self.filter_category_combobox.current()  # 選項文字含有客戶數，因此以索引對應分類
+        if selected_index <= 0:
             self.load_customers()
         else:
-            category_id = self.categories.get(selected_category_name)
-            if category_id: self.load_customers(category_id=category_id)
+            self.load_customers(category_id=self.filter_category_ids[selected_index])
                 
+    def sort_by(self, column, add=False):
+        """
+        改變列表的排序方式並重新載入。排序在 SQL 中完成，因此只會查詢第一頁。
+        :param add: False 時只依此欄位排序 (再點一次則反轉方向)；True 時加入為次要排序欄位 (已存在則反轉方向)。
+        """
+        keys = list(self.sort_keys)
+        columns = [key_column for key_column, _ in keys]
+        if add and column in columns:
+            index = columns.index(column)
+            keys[index] = (column, not keys[index][1])
+        elif add:
+            keys.append((column, False))
+        elif columns == [column]:
+            keys = [(column, not keys[0][1])]
+        else:
+            keys = [(column, False)]
+        self.sort_keys = keys
+        self.sort_order = SortOrder(keys)
+        self.update_headings()
+        self.load_customers(self.current_category_id)
+
+    def update_headings(self):
+        """更新欄位標題，以 ▲/▼ 標示排序方向，多欄排序時再加上排序順位"""
+        for column, title in self.COLUMN_TITLES.items():
+            self.tree.heading(column, text=title)
+        for position, (column, descending) in enumerate(self.sort_keys, start=1):
+            marker = "▼" if descending else "▲"
+            if len(self.sort_keys) > 1: marker += str(position)
+            self.tree.heading(column, text=f"{self.COLUMN_TITLES[column]} {marker}")
+
+    def apply_search(self):
+        """依搜尋框的內容搜尋客戶名稱與備註，並保留目前的分類篩選"""
+        self.search_after_id = None
+        search = self.search_entry.get().strip()
+        if search != self.current_search:
+            self.current_search = search
+            self.load_customers(self.current_category_id)
+
     def clear_filter(self):
         """顯示全部按鈕的處理函式"""
         self.filter_category_combobox.current(0)
+        self.search_entry.delete(0, tk.END)
+        self.current_search = ""
         self.load_customers()
 
     def add_customer(self):
@@ -288,43 +2153,50 @@ class CustomerApp:
             return
         category_id = self.categories.get(category_name)
         if category_id is None: messagebox.showerror("錯誤", "選擇的分類不存在！"); return
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("INSERT INTO customers (id, name, category_id, notes) VALUES (?, ?, ?, ?)",
-                           (cust_id, name, category_id, notes))
-            self.conn.commit()
+
+        def on_done(_):
             self.customer_id_entry.delete(0, tk.END); self.customer_name_entry.delete(0, tk.END); self.notes_entry.delete("1.0", tk.END)
-            self.clear_filter()
+            self.patch_insert(Customer(cust_id, name, category_id, category_name, notes).preview())
+            self.load_categories()  # 更新分類統計
             messagebox.showinfo("成功", f"客戶 {name} 已成功新增！")
-        except sqlite3.IntegrityError: messagebox.showerror("錯誤", f"客戶 ID '{cust_id}' 已存在，請使用不同的 ID。")
-        except Exception as e: messagebox.showerror("資料庫錯誤", f"發生錯誤: {e}")
+
+        def on_error(e):
+            if isinstance(e, sqlite3.IntegrityError): messagebox.showerror("錯誤", f"客戶 ID '{cust_id}' 已存在，請使用不同的 ID。")
+            else: messagebox.showerror("資料庫錯誤", f"發生錯誤: {e}")
+
+        self.db.submit(CustomerRepository.add_customer, cust_id, name, category_id, notes, on_done=on_done, on_error=on_error)
     
     def add_category(self):
         """新增分類按鈕的處理函式"""
         new_cat_name = self.new_category_entry.get().strip()
         if not new_cat_name: messagebox.showwarning("輸入錯誤", "請輸入新分類的名稱！"); return
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("INSERT INTO categories (name) VALUES (?)", (new_cat_name,))
-            self.conn.commit()
+
+        def on_done(_):
             self.new_category_entry.delete(0, tk.END)
             self.load_categories()
             messagebox.showinfo("成功", f"分類 '{new_cat_name}' 已成功新增！")
-        except sqlite3.IntegrityError: messagebox.showerror("錯誤", f"分類 '{new_cat_name}' 已存在！")
-        except Exception as e: messagebox.showerror("資料庫錯誤", f"發生錯誤: {e}")
+
+        def on_error(e):
+            if isinstance(e, sqlite3.IntegrityError): messagebox.showerror("錯誤", f"分類 '{new_cat_name}' 已存在！")
+            else: messagebox.showerror("資料庫錯誤", f"發生錯誤: {e}")
+
+        self.db.submit(CustomerRepository.add_category, new_cat_name, on_done=on_done, on_error=on_error)
 
     def delete_customer(self):
         """刪除客戶按鈕的處理函式"""
         selected_item = self.tree.selection()
         if not selected_item: messagebox.showwarning("操作錯誤", "請先在列表中選擇一位要刪除的客戶。"); return
-        customer_data = self.tree.item(selected_item, 'values')
-        customer_id, customer_name = customer_data[0], customer_data[1]
+        customer_id = selected_item[0]  # Treeview 列的 iid 就是客戶 ID
+        customer_name = self.cache.get(customer_id).name
         if messagebox.askyesno("確認刪除", f"確定要刪除客戶 '{customer_name}' (ID: {customer_id}) 嗎？\n此操作無法復原。"):
-            try:
-                cursor = self.conn.cursor(); cursor.execute("DELETE FROM customers WHERE id = ?", (customer_id,)); self.conn.commit()
-                self.load_customers()
+            def on_done(_):
+                self.details_cache.pop(customer_id)
+                self.patch_remove(customer_id)
+                self.load_categories()  # 更新分類統計
                 messagebox.showinfo("成功", f"客戶 '{customer_name}' 已被成功刪除。")
-            except Exception as e: messagebox.showerror("資料庫錯誤", f"刪除時發生錯誤: {e}")
+
+            self.db.submit(CustomerRepository.delete_customer, customer_id, on_done=on_done,
+                           on_error=lambda e: messagebox.showerror("資料庫錯誤", f"刪除時發生錯誤: {e}"))
             
     def save_customer_changes(self, edit_win, cust_id, name_entry, cat_combobox, notes_text):
         """儲存修改後客戶資料的函式"""
@@ -335,35 +2207,496 @@ class CustomerApp:
             messagebox.showwarning("輸入錯誤", "客戶名稱和分類為必填項！", parent=edit_win)
             return
         new_category_id = self.categories.get(new_category_name)
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("UPDATE customers SET name = ?, category_id = ?, notes = ? WHERE id = ?", 
-                           (new_name, new_category_id, new_notes, cust_id))
-            self.conn.commit()
-            edit_win.destroy()
-            self.load_customers()
+
+        def on_done(_):
+            if edit_win.winfo_exists(): edit_win.destroy()
+            old = self.cache.get(cust_id)
+            record = Customer(cust_id, new_name, new_category_id, new_category_name, new_notes)
+            self.details_cache.put(cust_id, record)
+            self.patch_update(record.preview())
+            if not old or old.category_id != new_category_id: self.load_categories()  # 分類改變時更新分類統計
             messagebox.showinfo("成功", "客戶資料已成功更新！")
-        except Exception as e:
-            messagebox.showerror("資料庫錯誤", f"更新時發生錯誤: {e}", parent=edit_win)
+
+        def on_error(e):
+            parent = edit_win if edit_win.winfo_exists() else self.root
+            messagebox.showerror("資料庫錯誤", f"更新時發生錯誤: {e}", parent=parent)
+
+        self.db.submit(CustomerRepository.update_customer, cust_id, new_name, new_category_id, new_notes,
+                       on_done=on_done, on_error=on_error)
             
     def delete_category(self):
         """刪除分類按鈕的處理函式"""
         category_name_to_delete = self.category_combobox.get()
         if not category_name_to_delete: messagebox.showwarning("操作錯誤", "請先從下拉選單中選擇一個要刪除的分類。"); return
         if messagebox.askyesno("確認刪除", f"確定要刪除分類 '{category_name_to_delete}' 嗎？\n注意：使用此分類的客戶將會失去分類連結。"):
-            try:
-                category_id = self.categories.get(category_name_to_delete)
-                cursor = self.conn.cursor(); cursor.execute("DELETE FROM categories WHERE id = ?", (category_id,)); self.conn.commit()
+            category_id = self.categories.get(category_name_to_delete)
+
+            def on_done(_):
+                self.details_cache.clear()  # 快取中屬於此分類的客戶都失去了分類
+                if self.current_category_id == category_id:
+                    self.clear_filter()  # 正在篩選的分類已不存在
+                elif self.current_search:
+                    # 搜尋結果的每次修改都會重新載入第一頁，因此只需要重新載入一次
+                    if self.cache.ids_in_category(category_id): self.load_customers(self.current_category_id)
+                else:
+                    # 只更新視窗中屬於此分類的客戶，讓它們的分類欄位變成空白 (依分類排序時會移到新的位置)。
+                    # 先取出所有資料列，逐列修補時快取的內容會跟著改變
+                    records = [self.cache.get(cust_id) for cust_id in self.cache.ids_in_category(category_id)]
+                    for record in records:
+                        self.patch_update(record._replace(category_id=None, category=None))
                 self.load_categories()
-                self.clear_filter()
                 messagebox.showinfo("成功", f"分類 '{category_name_to_delete}' 已被刪除。")
-            except Exception as e: messagebox.showerror("資料庫錯誤", f"刪除時發生錯誤: {e}")
+
+            self.db.submit(CustomerRepository.delete_category, category_id, on_done=on_done,
+                           on_error=lambda e: messagebox.showerror("資料庫錯誤", f"刪除時發生錯誤: {e}"))
                 
+    def open_bulk_window(self):
+        """
+        打開批次操作視窗。可以對列表中選取的客戶，或目前篩選結果的所有客戶 (包括尚未載入到畫面上的部分)，
+        一次執行刪除、移至其他分類或附加備註。
+        """
+        if self.bulk_window and self.bulk_window.winfo_exists():
+            self.bulk_window.lift()
+            return
+        selected_ids = list(self.tree.selection())
+
+        self.bulk_window = tk.Toplevel(self.root)
+        self.bulk_window.title("批次操作")
+        frame = ttk.Frame(self.bulk_window, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        # --- 操作對象 ---
+        scope = tk.StringVar(value="selection" if selected_ids else "filter")
+        ttk.Label(frame, text="對象:").grid(row=0, column=0, sticky="nw", pady=2)
+        selection_radio = ttk.Radiobutton(frame, text=f"選定的 {len(selected_ids)} 位客戶", variable=scope, value="selection")
+        selection_radio.grid(row=0, column=1, columnspan=2, sticky="w", pady=2)
+        if not selected_ids: selection_radio.config(state="disabled")
+        ttk.Radiobutton(frame, text="目前篩選結果的所有客戶", variable=scope, value="filter").grid(
+            row=1, column=1, columnspan=2, sticky="w", pady=2)
+
+        # --- 操作 ---
+        action = tk.StringVar(value="move")
+        ttk.Label(frame, text="操作:").grid(row=2, column=0, sticky="nw", pady=(10, 2))
+        ttk.Radiobutton(frame, text="移至分類", variable=action, value="move").grid(row=2, column=1, sticky="w", pady=(10, 2))
+        cat_combobox = ttk.Combobox(frame, state="readonly", values=list(self.categories.keys()))
+        if self.categories: cat_combobox.current(0)
+        cat_combobox.grid(row=2, column=2, sticky="ew", pady=(10, 2))
+        ttk.Radiobutton(frame, text="附加備註", variable=action, value="append").grid(row=3, column=1, sticky="w", pady=2)
+        notes_entry = ttk.Entry(frame, width=30)
+        notes_entry.grid(row=3, column=2, sticky="ew", pady=2)
+        ttk.Radiobutton(frame, text="刪除", variable=action, value="delete").grid(row=4, column=1, sticky="w", pady=2)
+
+        run_btn = ttk.Button(frame, text="執行", command=lambda: self.run_bulk_action(
+            self.bulk_window, selected_ids if scope.get() == "selection" else None,
+            action.get(), cat_combobox.get(), notes_entry.get().strip()))
+        run_btn.grid(row=5, column=2, sticky="e", pady=10)
+
+    def run_bulk_action(self, bulk_win, ids, action, category_name, notes):
+        """
+        執行批次操作：確認一次後，以單一 SQL 敘述在一個交易中完成，最後只重新整理一次列表。
+        :param ids: 選取的客戶 ID；為 None 時對象為目前篩選結果的所有客戶。
+        """
+        if action == "move" and category_name not in self.categories:
+            messagebox.showwarning("輸入錯誤", "請選擇要移至的分類！", parent=bulk_win); return
+        if action == "append" and not notes:
+            messagebox.showwarning("輸入錯誤", "請輸入要附加的備註！", parent=bulk_win); return
+        category_id, search = self.current_category_id, self.current_search
+        descriptions = {"move": f"移至分類 '{category_name}'", "append": f"附加備註 '{notes}'", "delete": "刪除"}
+
+        def confirm(count):
+            parent = bulk_win if bulk_win.winfo_exists() else self.root
+            if not count:
+                messagebox.showinfo("批次操作", "沒有符合條件的客戶。", parent=parent); return
+            message = f"確定要將 {count:,} 位客戶{descriptions[action]}嗎？"
+            if action == "delete": message += "\n此操作無法復原。"
+            if not messagebox.askyesno("確認批次操作", message, parent=parent): return
+            if action == "move":
+                func = lambda repo: repo.bulk_move(self.categories[category_name], ids, category_id, search)
+            elif action == "append":
+                func = lambda repo: repo.bulk_append_notes(notes, ids, category_id, search)
+            else:
+                func = lambda repo: repo.bulk_delete(ids, category_id, search)
+            self.start_progress("正在執行批次操作...")
+            self.db.submit(func, on_done=on_done, on_error=on_error)
+
+        def on_done(changed):
+            self.stop_progress(f"批次操作完成：{changed:,} 位客戶")
+            if bulk_win.winfo_exists(): bulk_win.destroy()
+            self.details_cache.clear()  # 受影響的客戶可能不在列表中，直接清空詳細資料快取
+            self.load_customers(self.current_category_id)
+            self.load_categories()  # 更新分類統計
+            messagebox.showinfo("成功", f"已將 {changed:,} 位客戶{descriptions[action]}。")
+
+        def on_error(e):
+            self.stop_progress()
+            messagebox.showerror("資料庫錯誤", f"批次操作時發生錯誤: {e}")
+
+        if ids is not None:
+            confirm(len(ids))
+        else:
+            self.db.submit(lambda repo: repo.count_matching(category_id, search), on_done=confirm, on_error=on_error)
+
+    def import_customers(self):
+        """
+        匯入客戶按鈕的處理函式。從 CSV 或 Excel 檔案批次新增客戶，
+        檔案在獨立的背景執行緒與連線中串流讀取並分批寫入，完成後才重新整理一次列表。
+        """
+        path = filedialog.askopenfilename(title="選擇要匯入的客戶檔案",
+                                          filetypes=[("CSV 或 Excel 檔案", "*.csv *.xlsx"), ("所有檔案", "*.*")])
+        if not path: return
+        create_categories = messagebox.askyesno("匯入客戶", "檔案中若有不存在的分類，是否自動建立？")
+        self.start_progress("正在匯入客戶...")
+
+        def report_progress(processed):
+            # 這個函式在背景執行緒中被呼叫，因此透過 post 把 UI 更新交回主執行緒
+            self.db.post(self.status_label.config, {"text": f"正在匯入客戶... 已處理 {processed:,} 筆"})
+
+        def on_done(result):
+            self.stop_progress(f"匯入完成：新增 {result.inserted:,} 筆")
+            self.load_categories()  # 更新分類與分類統計
+            self.clear_filter()
+            summary = f"成功新增 {result.inserted:,} 筆客戶。"
+            if result.created_categories:
+                summary += f"\n新建立的分類：{', '.join(result.created_categories)}"
+            if result.duplicates:
+                summary += f"\n略過 {len(result.duplicates):,} 筆重複的客戶 ID，例如：{', '.join(result.duplicates[:10])}"
+            if result.errors:
+                summary += f"\n略過 {len(result.errors):,} 筆不完整的資料：\n" + "\n".join(result.errors[:10])
+            messagebox.showinfo("匯入完成", summary)
+
+        def on_error(e):
+            self.stop_progress()
+            messagebox.showerror("匯入失敗", f"匯入時發生錯誤: {e}")
+
+        # 在獨立的連線上分批寫入，匯入期間列表仍可正常捲動、搜尋與修改；程式剛開啟時會先等待結構遷移完成
+        self.db.run_separately(lambda repo, cancel: repo.import_customers(
+                                   cancellable(read_customer_file(path), cancel), create_categories,
+                                   progress=report_progress),
+                               on_done=on_done, on_error=on_error, name="import", writes=True)
+
+    def export_customers(self):
+        """
+        匯出列表按鈕的處理函式。將目前篩選條件下的所有客戶 (不只是畫面上載入的部分)
+        串流寫入 CSV、JSON Lines 或 Parquet 檔案。
+        """
+        path = filedialog.asksaveasfilename(title="匯出客戶列表", defaultextension=".csv",
+                                            filetypes=[("CSV 檔案", "*.csv"), ("JSON Lines 檔案", "*.jsonl"),
+                                                       ("Parquet 檔案", "*.parquet")])
+        if not path: return
+        category_id = self.current_category_id
+        self.start_progress("正在匯出客戶...")
+
+        def report_progress(count):
+            self.db.post(self.status_label.config, {"text": f"正在匯出客戶... 已寫出 {count:,} 筆"})
+
+        def on_done(count):
+            self.stop_progress(f"匯出完成：{count:,} 筆")
+            messagebox.showinfo("匯出完成", f"已將 {count:,} 筆客戶匯出到\n{path}")
+
+        def on_error(e):
+            self.stop_progress()
+            messagebox.showerror("匯出失敗", f"匯出時發生錯誤: {e}")
+
+        # 匯出只讀取資料，在獨立的連線上執行，不會讓列表的其他操作排在它後面等待
+        self.db.run_separately(lambda repo, cancel: export_customers(
+                                   cancellable(repo.iter_customers(category_id), cancel), path, progress=report_progress),
+                               on_done=on_done, on_error=on_error, name="export")
+
+    def open_stats_window(self):
+        """
+        打開效能統計視窗 (只在啟用效能分析時可用)。
+        依操作彙總次數、總耗時、平均與最長耗時以及資料列數，每 STATS_REFRESH 毫秒自動更新。
+        """
+        if self.stats_window and self.stats_window.winfo_exists():
+            self.stats_window.lift(); return
+        self.stats_window = stats_win = tk.Toplevel(self.root)
+        stats_win.title("效能統計")
+        frame = ttk.Frame(stats_win, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        columns = (("kind", "類型", 70), ("name", "操作", 260), ("count", "次數", 60), ("total", "總耗時 (ms)", 90),
+                   ("avg", "平均 (ms)", 80), ("max", "最長 (ms)", 80), ("rows", "資料列數", 80))
+        stats_tree = ttk.Treeview(frame, columns=[column for column, _, _ in columns], show="headings", height=15)
+        for column, title, width in columns:
+            stats_tree.heading(column, text=title)
+            stats_tree.column(column, width=width, anchor=tk.W if column in ("kind", "name") else tk.E)
+        stats_tree.pack(fill=tk.BOTH, expand=True)
+        trace_label = ttk.Label(frame, text=f"關閉程式時會將追蹤記錄寫入 {os.path.abspath(self.profiler.trace_path)}")
+        trace_label.pack(side=tk.LEFT, pady=(10, 0))
+        ttk.Button(frame, text="立即寫入追蹤檔",
+                   command=lambda: trace_label.config(text=f"已寫入 {os.path.abspath(self.profiler.write_trace())}")
+                   ).pack(side=tk.RIGHT, pady=(10, 0))
+
+        def refresh():
+            if not stats_win.winfo_exists(): return
+            stats_tree.delete(*stats_tree.get_children())
+            for kind, name, count, total, average, longest, rows in self.profiler.summary():
+                stats_tree.insert("", tk.END, values=(kind, name, f"{count:,}", f"{total * 1000:,.1f}",
+                                                      f"{average * 1000:,.2f}", f"{longest * 1000:,.1f}", f"{rows:,}"))
+            stats_win.after(self.STATS_REFRESH, refresh)
+
+        refresh()
+
     def on_closing(self):
         """處理主視窗關閉事件的函式"""
-        if self.conn: self.conn.close()  # 關閉資料庫連線
+        self.db.shutdown()  # 停止背景執行緒並關閉資料庫連線 (最多等待 SHUTDOWN_TIMEOUT 秒)
+        if self.profiler:
+            print(f"效能追蹤記錄已寫入 {self.profiler.write_trace()}")
         self.root.destroy()  # 銷毀主視窗
 
+# --- 效能測試 ---
+BENCHMARK_SIZES = (10_000, 100_000, 1_000_000)  # 預設的測試資料量
+BENCHMARK_CATEGORIES = 4  # 測試資料平均分配到的分類數 (即預設分類的數量)
+
+def generate_benchmark_rows(count):
+    """產生效能測試用的客戶資料。名稱刻意打亂順序，避免插入順序剛好等於排序順序。"""
+    for i in range(count):
+        yield (f"C{i:07d}", f"客戶{(i * 7919) % count:07d}", 1 + i % BENCHMARK_CATEGORIES, f"測試備註 {i}")
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, page_size=100):
+    """
+    對 CustomerRepository 執行效能測試，量測新增、更新、篩選與列表的吞吐量 (每秒處理筆數)。
+    每個資料量都會使用一個全新的暫存資料庫，測試結束後自動刪除。
+    :param sizes: 要測試的資料量。
+    :param page_size: 篩選測試中每頁的筆數。
+    :return: {"<資料量>": {"<操作>": 每秒處理筆數}} 的字典。
+    """
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            repo = CustomerRepository(os.path.join(workdir, "benchmark.db"))
+            timings = {}
+
+            # 新增：單一交易批次寫入全部資料
+            start = time.perf_counter()
+            repo.add_customers(generate_benchmark_rows(size))
+            timings["insert"] = size / (time.perf_counter() - start)
+
+            # 更新：單一交易批次更新全部資料的備註
+            start = time.perf_counter()
+            repo.update_customers((name, cat_id, notes + " (已更新)", cust_id)
+                                  for cust_id, name, cat_id, notes in generate_benchmark_rows(size))
+            timings["update"] = size / (time.perf_counter() - start)
+
+            # 篩選：以分頁方式走完其中一個分類的所有客戶，模擬在列表中一路捲動到底
+            start = time.perf_counter()
+            rows, after = 0, None
+            while True:
+                page = repo.fetch_page(category_id=1, after=after, limit=page_size)
+                rows += len(page)
+                if len(page) < page_size:
+                    break
+                after = (page[-1].name, page[-1].id)
+            timings["filter"] = rows / (time.perf_counter() - start)
+
+            # 列表：依序讀出所有客戶
+            start = time.perf_counter()
+            rows = sum(1 for _ in repo.iter_customers())
+            timings["list"] = rows / (time.perf_counter() - start)
+
+            repo.close()
+        results[str(size)] = timings
+    return results
+
+def run_startup_benchmarks(sizes=BENCHMARK_SIZES, page_size=100, repeat=20):
+    """
+    量測 GUI 啟動到第一個畫面所需的資料庫工作時間，證明它不會隨資料表大小成長。
+    步驟與 CustomerApp 啟動時相同：工作執行緒開啟連線 (不執行遷移)、載入第一頁，
+    接著在遷移完成後載入各分類的客戶數。每個步驟重複 repeat 次並取中位數。
+    :return: {"<資料量>": {"open": 毫秒, "first_page": 毫秒, "categories": 毫秒}} 的字典，
+             其中 first_page 包含開啟連線的時間，也就是第一個畫面可以顯示之前的總時間。
+    """
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            db_name = os.path.join(workdir, "benchmark.db")
+            repo = CustomerRepository(db_name)
+            repo.add_customers(generate_benchmark_rows(size))
+            repo.close()
+            samples = {"open": [], "first_page": [], "categories": []}
+            for _ in range(repeat):
+                start = time.perf_counter()
+                repo = CustomerRepository(db_name, migrate=False)
+                opened = time.perf_counter()
+                repo.fetch_page(limit=page_size)
+                first_page = time.perf_counter()
+                repo.category_counts()
+                samples["open"].append(opened - start)
+                samples["first_page"].append(first_page - start)
+                samples["categories"].append(time.perf_counter() - first_page)
+                repo.conn.close()  # 不經過 close()，避免每次都執行 PRAGMA optimize
+        results[str(size)] = {step: sorted(times)[len(times) // 2] * 1000 for step, times in samples.items()}
+    return results
+
+def compare_benchmarks(results, baseline, tolerance, higher_is_better=True):
+    """
+    將效能測試結果與先前儲存的基準比較。
+    :param tolerance: 允許的退步比例，例如 0.2 代表最多可比基準慢 20%。
+    :param higher_is_better: 結果是吞吐量 (越大越好) 時為 True；是耗時 (越小越好) 時為 False。
+    :return: 退步項目的說明文字列表，沒有退步時為空列表。
+    """
+    unit = "筆/秒" if higher_is_better else "毫秒"
+    regressions = []
+    for size, timings in results.items():
+        for operation, value in timings.items():
+            expected = baseline.get(size, {}).get(operation)
+            if not expected:
+                continue
+            if (value < expected * (1 - tolerance)) if higher_is_better else (value > expected * (1 + tolerance)):
+                regressions.append(f"{size} 筆 {operation}: {value:,.2f} {unit} (基準 {expected:,.2f} {unit})")
+    return regressions
+
+def run_benchmark_command(args):
+    """bench 子命令：執行效能測試、列印結果，並視需要儲存或與基準比較"""
+    if args.suite == "startup":
+        results = run_startup_benchmarks(args.sizes)
+        print(f"{'資料量':>10} {'步驟':>10} {'毫秒':>10}")
+        for size, timings in results.items():
+            for step, ms in timings.items():
+                print(f"{int(size):>10,} {step:>10} {ms:>10.2f}")
+    else:
+        results = run_benchmarks(args.sizes)
+        print(f"{'資料量':>10} {'操作':>8} {'筆/秒':>14}")
+        for size, timings in results.items():
+            for operation, rate in timings.items():
+                print(f"{int(size):>10,} {operation:>8} {rate:>14,.0f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_benchmarks(results, json.load(f), args.tolerance,
+                                             higher_is_better=args.suite != "startup")
+        if regressions:
+            print("效能退步：", *regressions, sep="\n  ")
+            return 1
+    return 0
+
+def run_import_command(args):
+    """import 子命令：從 CSV 或 Excel 檔案批次匯入客戶，並在標準錯誤輸出顯示進度"""
+    repo = CustomerRepository(args.db)
+    try:
+        result = repo.import_customers(read_customer_file(args.file), args.create_categories, args.batch_size,
+                                       progress=lambda n: print(f"\r已處理 {n:,} 筆", end="", file=sys.stderr))
+    except UnicodeDecodeError as e:  # 是 ValueError 的子類別，因此必須先處理
+        print(f"\n無法讀取 {args.file}：CSV 檔案必須是 UTF-8 編碼 ({e})", file=sys.stderr)
+        return 1
+    except (ImportError, ValueError) as e:  # 缺少選用套件或檔案格式不符
+        print(e, file=sys.stderr)
+        return 1
+    except OSError as e:  # 檔案不存在或無法讀取
+        print(f"\n無法讀取 {args.file}：{e}", file=sys.stderr)
+        return 1
+    finally:
+        repo.close()
+    print(file=sys.stderr)
+    print(f"成功新增 {result.inserted:,} 筆客戶")
+    if result.created_categories:
+        print(f"新建立的分類：{', '.join(result.created_categories)}")
+    if result.duplicates:
+        print(f"略過 {len(result.duplicates):,} 筆重複的客戶 ID：")
+        for cust_id in result.duplicates:
+            print(f"    {cust_id}")
+    if result.errors:
+        print(f"略過 {len(result.errors):,} 筆不完整的資料：")
+        for error in result.errors:
+            print(f"    {error}")
+    return 0
+
+def run_export_command(args):
+    """export 子命令：將客戶列表 (可依分類篩選) 串流匯出成 CSV、JSON Lines 或 Parquet 檔案"""
+    repo = CustomerRepository(args.db)
+    try:
+        category_id = None
+        if args.category:
+            category_id = dict((name, cat_id) for cat_id, name in repo.list_categories()).get(args.category)
+            if category_id is None:
+                print(f"分類 '{args.category}' 不存在", file=sys.stderr)
+                return 1
+        count = export_customers(repo.iter_customers(category_id), args.file, args.format,
+                                 progress=lambda n: print(f"\r已寫出 {n:,} 筆", end="", file=sys.stderr))
+    except ImportError as e:  # 缺少選用套件
+        print(e, file=sys.stderr)
+        return 1
+    except OSError as e:  # 無法建立或寫入輸出檔案
+        print(f"\n無法寫入 {args.file}：{e}", file=sys.stderr)
+        return 1
+    finally:
+        repo.close()
+    print(file=sys.stderr)
+    print(f"已匯出 {count:,} 筆客戶到 {args.file}")
+    return 0
+
+def run_explain_command(args):
+    """explain 子命令：列印常用查詢的執行計畫，任何一個查詢沒有走索引時以代碼 1 結束"""
+    repo = CustomerRepository(args.db)
+    try:
+        plans = repo.explain_hot_queries()
+    finally:
+        repo.close()
+    for label, (ok, details) in plans.items():
+        print(f"[{'OK' if ok else '未使用索引'}] {label}")
+        for detail in details:
+            print(f"    {detail}")
+    return 0 if all(ok for ok, _ in plans.values()) else 1
+
+# --- 命令列介面 ---
+def build_arg_parser():
+    """建立命令列參數解析器。不帶子命令時啟動 GUI。"""
+    parser = argparse.ArgumentParser(description="簡易客戶分級系統")
+    parser.add_argument("--db", default="database.db", help="資料庫檔案名稱 (預設: database.db)")
+    parser.add_argument("--profile", nargs="?", const=DEFAULT_TRACE_FILE, metavar="TRACE",
+                        help=f"啟用效能分析，結束時將追蹤記錄寫入 TRACE (預設: {DEFAULT_TRACE_FILE})；"
+                             f"也可以設定環境變數 {PROFILE_ENV_VAR}=1 或 {PROFILE_ENV_VAR}=追蹤檔路徑")
+    subparsers = parser.add_subparsers(dest="command")
+
+    bench_parser = subparsers.add_parser("bench", help="執行資料存取層的效能測試")
+    bench_parser.add_argument("suite", nargs="?", choices=("throughput", "startup"), default="throughput",
+                              help="throughput 量測新增、更新、篩選與列表的吞吐量 (預設)；startup 量測啟動到第一個畫面的時間")
+    bench_parser.add_argument("--sizes", type=int, nargs="+", default=list(BENCHMARK_SIZES),
+                              help="要測試的資料量 (預設: 10000 100000 1000000)")
+    bench_parser.add_argument("--output", help="將結果以 JSON 格式儲存到此檔案，可作為日後比較的基準")
+    bench_parser.add_argument("--baseline", help="與此 JSON 基準檔比較，吞吐量退步超過容許值時以代碼 1 結束")
+    bench_parser.add_argument("--tolerance", type=float, default=0.2, help="允許的退步比例 (預設: 0.2)")
+
+    subparsers.add_parser("explain", help="以 EXPLAIN QUERY PLAN 檢查常用查詢是否使用索引")
+
+    import_parser = subparsers.add_parser("import", help="從 CSV 或 Excel (.xlsx) 檔案批次匯入客戶")
+    import_parser.add_argument("file", help="要匯入的檔案，第一列為欄位標題 (id/客戶 ID, name/客戶名稱, category/分類, notes/備註)")
+    import_parser.add_argument("--create-categories", action="store_true", help="自動建立檔案中不存在的分類")
+    import_parser.add_argument("--batch-size", type=int, default=5000, help="每個交易寫入的筆數 (預設: 5000)")
+
+    export_parser = subparsers.add_parser("export", help="將客戶列表匯出成 CSV、JSON Lines 或 Parquet 檔案")
+    export_parser.add_argument("file", help="輸出檔案")
+    export_parser.add_argument("--category", help="只匯出此分類 (分類名稱) 的客戶")
+    export_parser.add_argument("--format", choices=sorted(set(EXPORT_FORMATS.values())), help="輸出格式 (預設依副檔名判斷)")
+    return parser
+
+def main(argv=None):
+    """解析命令列參數，執行子命令或啟動 GUI。返回程式的結束代碼。"""
+    args = build_arg_parser().parse_args(argv)
+    if args.command == "bench":
+        return run_benchmark_command(args)
+    if args.command == "explain":
+        return run_explain_command(args)
+    if args.command == "import":
+        return run_import_command(args)
+    if args.command == "export":
+        return run_export_command(args)
+
+    # 效能分析：命令列參數優先，其次是環境變數 (值為 1 時使用預設的追蹤檔路徑)
+    trace_path = args.profile or os.environ.get(PROFILE_ENV_VAR)
+    if trace_path in ("0", ""):
+        trace_path = None
+    elif trace_path == "1":
+        trace_path = DEFAULT_TRACE_FILE
+    profiler = Profiler(trace_path) if trace_path else None
+
+    root = tk.Tk()  # 建立 Tkinter 的根視窗
+    app = CustomerApp(root, db_name=args.db, profiler=profiler)  # 建立我們的應用程式類別實例
+    root.protocol("WM_DELETE_WINDOW", app.on_closing)  # 攔截視窗關閉按鈕，執行自訂的 on_closing 函式
+    root.mainloop()  # 進入 Tkinter 的事件迴圈，等待使用者操作
+    return 0
+
 # --- 程式主入口 ---
 if __name__ == "__main__":
     """
@@ -371,7 +2704,4 @@ if __name__ == "__main__":
     當這個檔案被直接執行時，以下的程式碼會被觸發。
     如果這個檔案被其他檔案 import，則不會執行。
     """
-    root = tk.Tk()  # 建立 Tkinter 的根視窗
-    app = CustomerApp(root)  # 建立我們的應用程式類別實例
-    root.protocol("WM_DELETE_WINDOW", app.on_closing)  # 攔截視窗關閉按鈕，執行自訂的 on_closing 函式
-    root.mainloop()  # 進入 Tkinter 的事件迴圈，等待使用者操作
\ No newline at end of file
+    sys.exit(main())